@@ -219,6 +219,39 @@ replace_data(PyObject *self, PyObject *args) {
     Py_RETURN_NONE;
 }
 
+// add (change=1) or remove (change=-1) the rows of obs to nij and nijk
+PyObject *
+_change_counts(PyObject *args, int change) {
+    int pycpt;
+    register int i,j;
+    PyArrayObject *obs;
+    
+    if (!PyArg_ParseTuple(args, "iO!", &pycpt, &PyArray_Type, &obs)) {
+        return NULL;
+    }
+    
+    CPT *cpt = (CPT*) pycpt;
+    int nx = PyArray_DIM(obs, 0);
+
+    for (i=0; i<nx; i++) {
+        j = cptindex(obs, i, cpt->offsets, cpt->num_parents);
+        cpt->counts[j][0] += change;
+        cpt->counts[j][*(int*)PyArray_GETPTR2(obs,i,0) + 1] += change;
+    }
+
+    Py_RETURN_NONE;
+}
+
+PyObject *
+add_data(PyObject *self, PyObject *args) {
+    return _change_counts(args, 1);
+}
+
+PyObject *
+remove_data(PyObject *self, PyObject *args) {
+    return _change_counts(args, -1);
+}
+
 
 PyObject *
 loglikelihood(PyObject *self, PyObject *args) {
@@ -262,6 +295,8 @@ static PyMethodDef cpd_methods[] = {
     {"buildcpt", (PyCFunction)buildcpt, METH_VARARGS},
     {"loglikelihood", (PyCFunction)loglikelihood, METH_VARARGS},
     {"replace_data", (PyCFunction)replace_data, METH_VARARGS},
+    {"add_data", (PyCFunction)add_data, METH_VARARGS},
+    {"remove_data", (PyCFunction)remove_data, METH_VARARGS},
     {"dealloc_cpt", (PyCFunction)dealloc_cpt, METH_VARARGS},
     {NULL, NULL} /* sentinel */
 };
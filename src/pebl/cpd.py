@@ -58,6 +58,26 @@ class CPD(object):
         """
         pass
 
+    def add_data(self, observations):
+        """Adds data rows to the CPD.
+
+        Counts are additive, so a CPD for a dataset that has grown (see
+        Dataset.append) can be updated by counting only the new rows instead of
+        being recreated. observations should have the same columns as the
+        data used to create the CPD.
+
+        """
+        pass
+
+    def remove_data(self, observations):
+        """Removes data rows from the CPD.
+
+        This is the inverse of add_data. The rows must have been counted by
+        the CPD (when it was created or with add_data).
+
+        """
+        pass
+
 
 class MultinomialCPD_Py(CPD):
     """Pure python implementation of Multinomial cpd.
@@ -105,6 +125,15 @@ class MultinomialCPD_Py(CPD):
         self.counts[remove_index][oldrow[0]] -= 1
         self.counts[remove_index][-1] -= 1
 
+    def add_data(self, observations):
+        self._change_counts(observations, 1)
+
+        maxcount = self.counts[:,-1].sum() + self.counts.shape[1]
+        if len(self.__class__.lnfactorial_cache) < maxcount:
+            self._prefill_lnfactorial_cache(maxcount)
+
+    def remove_data(self, observations):
+        self._change_counts(observations, -1)
 
     def loglikelihood(self):
         lnfac = self.lnfactorial_cache
@@ -125,12 +154,18 @@ class MultinomialCPD_Py(CPD):
     # Private methods
     #
     def _change_counts(self, observations, change=1):
-        indices = N.dot(observations, self.offsets)
-        child_values = observations[:,0]
-
-        for j,k in izip(indices, child_values):
-            self.counts[j,k] += change
-            self.counts[j,-1] += change
+        # count parent configurations (j) and child values (k) a column at a
+        # time; this reads each column sequentially with column-major data.
+        qi, ri = self.counts.shape[0], self.counts.shape[1] - 1
+        indices = N.zeros(observations.shape[0], dtype=int)
+        for col,offset in enumerate(self.offsets):
+            if col > 0:
+                indices += observations[:,col].astype(int) * int(offset)
+        child_values = observations[:,0].astype(int)
+
+        self.counts[:,:-1] += change * N.bincount(
+            indices*ri + child_values, minlength=qi*ri).reshape((qi,ri))
+        self.counts[:,-1] += change * N.bincount(indices, minlength=qi)
 
     def _prefill_lnfactorial_cache(self, size):
         # logs = log(x) for x in [0, 1, 2, ..., size+10]
@@ -158,6 +193,7 @@ class MultinomialCPD_C(MultinomialCPD_Py):
             self._prefill_lnfactorial_cache(maxcount)
         
         self.__cpt = _cpd.buildcpt(data_.observations, arities, num_parents)
+        self.__maxcount = maxcount
 
     def loglikelihood(self):
         return _cpd.loglikelihood(self.__cpt, self.lnfactorial_cache)
@@ -165,9 +201,55 @@ class MultinomialCPD_C(MultinomialCPD_Py):
     def replace_data(self, oldrow, newrow):
         _cpd.replace_data(self.__cpt, oldrow, newrow)
 
+    def add_data(self, observations):
+        _cpd.add_data(self.__cpt, observations)
+
+        self.__maxcount += observations.shape[0]
+        if len(self.__class__.lnfactorial_cache) < self.__maxcount:
+            self._prefill_lnfactorial_cache(self.__maxcount)
+
+    def remove_data(self, observations):
+        _cpd.remove_data(self.__cpt, observations)
+
     def __del__(self):
         _cpd.dealloc_cpt(self.__cpt)
 
 
+class PooledMultinomialCPD(MultinomialCPD_Py):
+    """Multinomial cpd for data pooled from several datasets.
+
+    cpds should be MultinomialCPD_Py instances for the same variables, each
+    created from one of the datasets. The counts are their sums, so the
+    pooled dataset is never created.
+
+    """
+
+    def __init__(self, cpds):
+        self.data = cpds[0].data
+        self.offsets = cpds[0].offsets
+        self.counts = N.sum([c.counts for c in cpds], axis=0)
+        
+        # ensure that there won't be a cache miss
+        maxcount = self.counts[:,-1].sum() + self.counts.shape[1]
+        if len(self.__class__.lnfactorial_cache) < maxcount:
+            self._prefill_lnfactorial_cache(maxcount)
+
+
+class ProductCPD(CPD):
+    """CPD for several independent datasets.
+
+    cpds should be CPDs for the same variables, each created from one of the
+    datasets. Each dataset has its own parameters, so the likelihood is the
+    product of the likelihoods of the cpds.
+
+    """
+
+    def __init__(self, cpds):
+        self.cpds = cpds
+
+    def loglikelihood(self):
+        return sum(c.loglikelihood() for c in self.cpds)
+
+
 # use the C implementation if possible, else the python one
 MultinomialCPD = MultinomialCPD_C if _cpd else MultinomialCPD_Py
@@ -33,6 +33,18 @@ _pdiscretize = config.IntParameter(
     default=0
 )
 
+_playout = config.StringParameter(
+    'data.layout',
+    """Memory layout of the observations. Choices include:
+        * rows: row-major order (each sample is contiguous)
+        * columns: column-major order (each variable is contiguous). Faster
+                   for datasets with many variables because the data for a
+                   family of variables is read one column at a time.
+    """,
+    config.oneof('rows', 'columns'),
+    default='rows'
+)
+
 #
 # Exceptions
 #
@@ -139,6 +151,9 @@ class Dataset(object):
              * If variables or samples are not specified, appropriate Variable or
                Sample annotations are created with only the name attribute.
 
+        The observations, missing and interventions arrays can be stored in
+        row-major or column-major order (see set_layout).
+
         Note:
             If you alter Dataset.interventions or Dataset.missing, you must
             call Dataset._calc_stats(). This is a terrible hack but it speeds
@@ -208,15 +223,156 @@ class Dataset(object):
             d._has_interventions = False
             d._has_missing = False
 
+        if self.layout == 'columns':
+            d.set_layout('columns')
         return d
 
+    def append(self, observations, missing=None, interventions=None,
+               samples=None):
+        """Appends samples to the dataset (in-place).
+
+        observations, missing and interventions are 2D arrays for the new
+        samples with the same variables as this dataset. As with the Dataset
+        constructor, missing and interventions default to all zeros and
+        Sample annotations are created if samples is not specified.
+
+        Returns a Dataset with only the new samples. Evaluators use it to
+        update their cached scores by counting only the new samples (see
+        NetworkEvaluator.append_data).
+
+        """
+
+        new = self._new_samples(observations, missing, interventions, samples)
+        layout = self.layout
+        self.observations = N.concatenate((self.observations, new.observations))
+        self.missing = N.concatenate((self.missing, new.missing))
+        self.interventions = N.concatenate((self.interventions, new.interventions))
+        self.samples = N.concatenate((self.samples, new.samples))
+        self.set_layout(layout)
+        self._calc_stats()
+
+        return new
+
+    def replace_samples(self, rows, observations, missing=None, 
+                        interventions=None, samples=None):
+        """Replaces the samples at rows with new samples (in-place).
+
+        The other arguments are those of Dataset.append, with a new sample for
+        each of the rows. Unlike append, the arrays are overwritten instead of
+        being copied, so a window over a stream of samples can be kept as a
+        ring buffer (see SlidingWindowNetworkEvaluator).
+
+        Returns a Dataset with only the new samples and one with the samples
+        that were replaced.
+
+        """
+
+        new = self._new_samples(observations, missing, interventions, samples)
+        old = self.subset(samples=rows)
+
+        self.observations[rows] = new.observations
+        self.missing[rows] = new.missing
+        self.interventions[rows] = new.interventions
+        self.samples[rows] = new.samples
+
+        # the replaced samples may have had the only missing values or
+        # interventions, so these are recalculated when needed.
+        self.__dict__.pop('_has_interventions', None)
+        self.__dict__.pop('_has_missing', None)
+
+        return new, old
+
+    def _new_samples(self, observations, missing, interventions, samples):
+        # a Dataset of new samples of this dataset's variables
+        numsamples = self.samples.size
+        observations = N.asarray(observations, dtype=self.observations.dtype)
+        if samples is None:
+            samples = N.array([Sample(str(i)) for i in 
+                        xrange(numsamples, numsamples + observations.shape[0])])
+        
+        new = Dataset(observations, missing, interventions, self.variables,
+                      N.asarray(samples))
+        new.check_arities()
+        return new
+
+    def add_variables(self, observations, missing=None, interventions=None,
+                      variables=None):
+        """Adds variables to the dataset (in-place).
+
+        observations, missing and interventions are 2D arrays with the values
+        of the new variables for each sample of this dataset. As with the
+        Dataset constructor, missing and interventions default to all zeros
+        and Variable annotations (with guessed arities) are created if
+        variables is not specified.
+
+        The new variables get the ids after the existing ones, so subsets of
+        the existing variables are unchanged. Returns a Dataset with only the
+        new variables.
+
+        """
+
+        new = Dataset(N.asarray(observations, dtype=self.observations.dtype),
+                      missing, interventions, variables, self.samples)
+        if variables is None:
+            numvars = self.variables.size
+            for i,v in enumerate(new.variables):
+                v.name = str(numvars + i)
+        new.check_arities()
+
+        layout = self.layout
+        self.observations = N.hstack((self.observations, new.observations))
+        self.missing = N.hstack((self.missing, new.missing))
+        self.interventions = N.hstack((self.interventions, new.interventions))
+        self.variables = N.concatenate((self.variables, new.variables))
+        self.set_layout(layout)
+        self._calc_stats()
+
+        return new
+
+    def set_layout(self, layout):
+        """Sets the memory layout of the observations, missing and interventions.
+
+        layout should be one of:
+            * 'rows': row-major order; each sample's values are contiguous. 
+            * 'columns': column-major order; each variable's values are
+              contiguous.
+
+        Scoring a family of variables reads a few columns for all samples,
+        which is faster with the column-major layout when the dataset has
+        many variables.
+
+        """
+
+        if layout == 'columns':
+            convert = N.asfortranarray
+        elif layout == 'rows':
+            convert = N.ascontiguousarray
+        else:
+            raise ValueError("Unknown layout: %s" % layout)
+
+        self.observations = convert(self.observations)
+        self.missing = convert(self.missing)
+        self.interventions = convert(self.interventions)
+
+    @property
+    def layout(self):
+        """The memory layout of the observations ('rows' or 'columns')."""
+        flags = self.observations.flags
+        return 'columns' if flags.f_contiguous and not flags.c_contiguous \
+                         else 'rows'
     
     def _subset_ni_fast(self, variables):
         ds = _FastDataset.__new__(_FastDataset)
 
+        # with the column-major layout, select the columns first so that
+        # they're read sequentially.
         if not self.has_interventions:
             ds.observations = self.observations[:,variables]
             ds.samples = self.samples
+        elif self.layout == 'columns':
+            samples = N.where(self.interventions[:,variables[0]] == False)[0] 
+            ds.observations = self.observations[:,variables][samples]
+            ds.samples = self.samples[samples]
         else:
             samples = N.where(self.interventions[:,variables[0]] == False)[0] 
             ds.observations = self.observations[samples][:,variables]
@@ -399,7 +555,7 @@ class _FastDataset(Dataset):
 #
 # Factory Functions
 #
-def fromfile(filename):
+def fromfile(filename, layout=None):
     """Parse file and return a Dataset instance.
 
     The data file is expected to conform to the following format
@@ -427,16 +583,21 @@ def fromfile(filename):
         - Foo,class(normal,cancer): Foo is a class variable with arity of 2 and
                                     values of either normal or cancer.
 
+    layout is the memory layout of the observations ('rows' or 'columns'; see
+    Dataset.set_layout). If not specified, the data.layout config parameter is
+    used.
+
     """
     
     with file(filename) as f:
-        return fromstring(f.read())
+        return fromstring(f.read(), layout=layout)
 
 
-def fromstring(stringrep, fieldsep='\t'):
+def fromstring(stringrep, fieldsep='\t', layout=None):
     """Parse the string representation of a dataset and return a Dataset instance.
     
-    See the documentation for fromfile() for information about file format.
+    See the documentation for fromfile() for information about file format and
+    layout.
     
     """
 
@@ -567,6 +728,7 @@ def fromstring(stringrep, fieldsep='\t'):
         samples,
     )
     d.check_arities()
+    d.set_layout(layout or config.get('data.layout'))
     return d
 
 
@@ -600,6 +762,9 @@ def merge(datasets, axis=None):
     datasets should be a list of Dataset objects.
     axis should be either 'variables' or 'samples' and determines how the
     datasets are merged.  
+
+    To score networks with several datasets without merging them, see
+    evaluator.PooledNetworkEvaluator.
     
     """
 
@@ -1,7 +1,13 @@
 """Classes and functions for efficiently evaluating networks."""
 
-from math import log
+from math import log, exp, lgamma
+from itertools import chain
+from collections import OrderedDict
+import os
 import random
+import cPickle
+import traceback
+import time
 
 import numpy as N
 
@@ -31,14 +37,24 @@ class LocalscoreCache(object):
             'localscore_cache.maxsize',
             "Max number of localscores to cache. Default=-1 means unlimited size.",
             default=-1
+        ),
+        config.IntParameter(
+            'localscore_cache.keep_cpds',
+            """Set to 1 to keep the cpds (with their count tables) of cached
+            localscores so that they can be updated when samples are appended
+            to the data. This uses more memory.""",
+            config.between(0, 1),
+            default=0
         )
     )
 
     def __init__(self, evaluator, cachesize=None):
         self._cache = {}
+        self._cpds = {}
         self._queue = deque()
         self._refcount = {}
         self.cachesize = cachesize or config.get('localscore_cache.maxsize')
+        self.keep_cpds = config.get('localscore_cache.keep_cpds')
 
         self.neteval = evaluator
         self.hits = 0
@@ -59,7 +75,10 @@ class LocalscoreCache(object):
             score = _cache[index]
             self.hits += 1
         except KeyError:
-            score = _cache[index] = self.neteval._cpd(node, parents).loglikelihood()
+            cpd_ = self.neteval._cpd(node, parents)
+            score = _cache[index] = cpd_.loglikelihood()
+            if self.keep_cpds:
+                self._cpds[index] = cpd_
             self.misses += 1
 
         # if using LRU cache (maxsize != -1)
@@ -67,26 +86,184 @@ class LocalscoreCache(object):
             # record that key was accessed
             _queue.append(index)
             _refcount[index] = _refcount.get(index, 0) + 1
-
-            # purge LRU entry
-            while _len(_cache) > _maxsize:
-                k = _queue.popleft()
-                _refcount[k] -= 1
-                if not _refcount[k]:
-                    del _cache[k]
-                    del _refcount[k]
-
-            # Periodically compact the queue by duplicate keys
-            if _len(_queue) > _maxsize * 4:
-                for i in xrange(_len(_queue)):
-                    k = _queue.popleft()
-                    if _refcount[k] == 1:
-                        _queue.append(k)
-                    else:
-                        _refcount[k] -= 1
+            self._purge()
             
         return score
 
+    def _purge(self):
+        _len = len
+        _queue = self._queue
+        _refcount = self._refcount
+        _cache = self._cache
+        _maxsize = self.cachesize
+
+        # purge LRU entry
+        while _len(_cache) > _maxsize:
+            k = _queue.popleft()
+            _refcount[k] -= 1
+            if not _refcount[k]:
+                del _cache[k]
+                del _refcount[k]
+                self._cpds.pop(k, None)
+
+        # Periodically compact the queue by duplicate keys
+        if _len(_queue) > _maxsize * 4:
+            for i in xrange(_len(_queue)):
+                k = _queue.popleft()
+                if _refcount[k] == 1:
+                    _queue.append(k)
+                else:
+                    _refcount[k] -= 1
+
+    def __contains__(self, index):
+        # whether the localscore for index (a tuple of node and parents) is
+        # cached (without counting a hit or miss)
+        return index in self._cache
+
+    def store(self, index, score):
+        """Caches a localscore calculated elsewhere (in another process, say).
+
+        index is a tuple of the node and its parents.
+
+        """
+
+        self._cache[index] = score
+        if self.cachesize > 0:
+            self._queue.append(index)
+            self._refcount[index] = self._refcount.get(index, 0) + 1
+            self._purge()
+
+    def clear(self):
+        """Discards all cached localscores."""
+
+        self._cache.clear()
+        self._cpds.clear()
+        self._queue.clear()
+        self._refcount.clear()
+
+    def update(self, newdata, olddata=None):
+        """Updates the cached localscores for samples appended to the data.
+
+        newdata should be a Dataset with only the new samples (as returned by
+        Dataset.append) and olddata, if specified, one with the samples
+        removed from the data. Localscores cached with their cpds (see
+        localscore_cache.keep_cpds) are updated by counting only these
+        samples. The rest are discarded and will be recomputed when needed.
+
+        """
+
+        for index in self._cache.keys():
+            cpd_ = self._cpds.get(index)
+            if cpd_ is not None:
+                variables = list(index)
+                cpd_.add_data(newdata._subset_ni_fast(variables).observations)
+                if olddata is not None:
+                    cpd_.remove_data(
+                        olddata._subset_ni_fast(variables).observations)
+                self._cache[index] = cpd_.loglikelihood()
+            else:
+                del self._cache[index]
+
+        # forget the discarded localscores in the LRU queue 
+        if len(self._refcount) > len(self._cache):
+            _cache = self._cache
+            self._queue = deque(k for k in self._queue if k in _cache)
+            self._refcount = dict((k,c) for k,c in self._refcount.iteritems() 
+                                  if k in _cache)
+
+
+
+#
+# Instrumentation
+#
+class EvaluatorStats(object):
+    """Cumulative times and call counts for the phases of network scoring.
+
+    Once a network evaluator is instrumented (see NetworkEvaluator.instrument
+    and the evaluator.instrument config parameter), the following phases are
+    timed:
+
+        * subset: creating the subset of the data for a family
+        * cpt: building the conditional probability table from that subset
+        * loglikelihood: calculating the loglikelihood of a cpd 
+        * cache: localscore cache lookups (includes the three phases above
+          for cache misses)
+        * acyclicity: checking whether changes to the network create cycles
+        * prior: scoring the network with the prior
+        * backup, restore: saving and restoring state for restore_network
+
+    times and calls are dicts of phase -> seconds and phase -> count.
+
+    """
+
+    phases = ('subset', 'cpt', 'loglikelihood', 'cache', 'acyclicity', 
+              'prior', 'backup', 'restore')
+
+    def __init__(self):
+        self.times = dict((phase, 0.0) for phase in self.phases)
+        self.calls = dict((phase, 0) for phase in self.phases)
+
+    def merge(self, other):
+        """Adds the times and counts of another EvaluatorStats to this one."""
+        for phase in self.phases:
+            self.times[phase] += other.times[phase]
+            self.calls[phase] += other.calls[phase]
+        return self
+
+    def report(self):
+        """Returns a table of the times and counts as a string."""
+        lines = ["%-14s %12s %12s %14s" % ('phase', 'calls', 'time (s)', 
+                                           'per call (us)')]
+        for phase in self.phases:
+            calls, seconds = self.calls[phase], self.times[phase]
+            percall = (seconds / calls * 1e6) if calls else 0.0
+            lines.append("%-14s %12d %12.3f %14.2f" % (phase, calls, seconds, 
+                                                      percall))
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.report()
+
+
+class _Timed(object):
+    # Wraps a function, adding the time and number of its calls to a phase of
+    # an EvaluatorStats.
+    def __init__(self, stats, phase, func):
+        self.stats = stats
+        self.phase = phase
+        self.func = func
+
+    def __call__(self, *args, **kwargs):
+        start = time.time()
+        result = self.func(*args, **kwargs)
+        self.stats.times[self.phase] += time.time() - start
+        self.stats.calls[self.phase] += 1
+        return result
+
+
+class _TimedCPD(object):
+    # Replaces NetworkEvaluator._cpd for instrumented evaluators, timing the
+    # data subset and cpt build separately and the loglikelihood calls of the
+    # returned cpd.
+    def __init__(self, stats, evaluator_):
+        self.stats = stats
+        self.evaluator = evaluator_
+
+    def __call__(self, node, parents):
+        stats = self.stats
+        start = time.time()
+        subset = self.evaluator.data._subset_ni_fast([node] + parents)
+        middle = time.time()
+        cpd_ = cpd.MultinomialCPD(subset)
+        end = time.time()
+        
+        stats.times['subset'] += middle - start
+        stats.times['cpt'] += end - middle
+        stats.calls['subset'] += 1
+        stats.calls['cpt'] += 1
+
+        cpd_.loglikelihood = _Timed(stats, 'loglikelihood', cpd_.loglikelihood)
+        return cpd_
 
 
 #
@@ -110,13 +287,34 @@ class NetworkEvaluator(object):
         self.score = None
         self._localscore = localscore_cache or LocalscoreCache(self)
         self.localscore_cache = self._localscore
+        self.stats = None
 
     #
     # Private Interface
     # 
     def _globalscore(self, localscores):
         # log(P(M|D)) +  log(P(M)) == likelihood + prior
-        return N.sum(localscores) + self.prior.loglikelihood(self.network)
+        return N.sum(localscores) + self._priorscore()
+
+    def _priorscore(self):
+        return self.prior.loglikelihood(self.network)
+
+    def _is_acyclic(self, nodes):
+        # whether the network is acyclic (checking only cycles through nodes)
+        return self.network.is_acyclic(nodes)
+
+    def _add_variables(self, observations, missing, interventions, variables,
+                       prior_):
+        # add variables to the data, nodes to the network and update the prior
+        if prior_ is None and not isinstance(self.prior, prior.NullPrior):
+            raise Exception("Specify a prior for the network with the new variables.")
+
+        newdata = self.data.add_variables(observations, missing, interventions,
+                                          variables)
+        self.network.add_nodes(newdata.variables)
+        self.datavars = range(self.data.variables.size)
+        self.prior = prior_ or self.prior
+        return newdata
     
     def _cpd(self, node, parents):
         #return cpd.MultinomialCPD(
@@ -139,6 +337,51 @@ class NetworkEvaluator(object):
     #
     # Public Interface
     #
+    def instrument(self, stats=None):
+        """Time the phases of scoring networks with this evaluator.
+
+        Returns the EvaluatorStats instance (stats or a new one) that collects
+        the times and call counts, which is also available as self.stats.
+        Instrumentation only adds a couple of calls to time.time() per timed
+        call, so it's cheap enough to leave on.
+
+        """
+        
+        self.stats = stats or self.stats or EvaluatorStats()
+        self._install_timers()
+        return self.stats
+
+    def _install_timers(self):
+        stats = self.stats
+        self._cpd = _TimedCPD(stats, self)
+        for phase,attr in (('cache', '_localscore'), 
+                           ('acyclicity', '_is_acyclic'), 
+                           ('prior', '_priorscore'), 
+                           ('backup', '_backup_state'), 
+                           ('restore', '_restore_state')):
+            func = getattr(self, attr, None)
+            if func is not None and not isinstance(func, _Timed):
+                setattr(self, attr, _Timed(stats, phase, func))
+
+    def __getstate__(self):
+        # timers wrap bound methods (which can't be pickled), so remove them.
+        # They are reinstalled when unpickled.
+        state = self.__dict__.copy()
+        for attr,value in self.__dict__.iteritems():
+            if isinstance(value, _TimedCPD):
+                del state[attr]
+            elif isinstance(value, _Timed):
+                if getattr(value.func, 'im_self', None) is self:
+                    del state[attr]
+                else:
+                    state[attr] = value.func
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.stats is not None:
+            self._install_timers()
+
     def score_network(self, net=None):
         """Score a network.
 
@@ -156,6 +399,106 @@ class NetworkEvaluator(object):
         self.network.edges.add_many(add)
         self.network.edges.remove_many(remove)
         return self.score_network()
+
+    def race_move(self, add=[], remove=[], minscore=prior.NEGINF):
+        """Check whether a change could score at least minscore.
+
+        This evaluator does not screen moves, so every move is promising. See
+        SmartNetworkEvaluator.race_move.
+
+        """
+
+        return True
+
+    def append_data(self, observations, missing=None, interventions=None,
+                    samples=None):
+        """Append samples to the data and rescore the network.
+
+        The arguments are those of Dataset.append. The localscore cache is
+        updated by counting only the new samples (see LocalscoreCache.update),
+        so networks scored before the samples were appended can be rescored
+        cheaply.
+
+        """
+
+        newdata = self.data.append(observations, missing, interventions, samples)
+        self.localscore_cache.update(newdata)
+        return self.score_network()
+
+    def score_networks(self, networks, processes=1):
+        """Score several networks.
+
+        Returns a list with the score of each of the networks. Each distinct
+        family (a node and its parents) is scored only once for all the
+        networks, so the cost depends on the number of distinct families
+        rather than on the number of networks. With processes > 1 (and if
+        os.fork is available), the families that aren't in the localscore
+        cache are scored in that many processes.
+
+        The evaluator's network and score are not changed. Raises
+        CyclicNetworkError if any of the networks has a cycle.
+
+        """
+
+        networks = list(networks)
+        families = []
+        for net in networks:
+            if not net.is_acyclic():
+                raise CyclicNetworkError()
+            parents = net.edges.parents
+            families.append([(n,) + tuple(parents(n)) for n in self.datavars])
+
+        localscores = dict.fromkeys(chain(*families))
+        uncached = [f for f in localscores if not self._family_cached(f)]
+        if processes > 1 and len(uncached) > 1 and hasattr(os, 'fork'):
+            bounds = N.linspace(0, len(uncached), processes + 1).astype(int)
+            tasks = [_ForkedTask(self._family_scores, uncached[start:stop])
+                     for start,stop in zip(bounds[:-1], bounds[1:]) 
+                     if stop > start]
+            for task in tasks:
+                scores = task.result()
+                self._cache_family_scores(scores)
+                localscores.update(scores)
+        localscores.update(self._family_scores(
+            [f for f in localscores if localscores[f] is None]))
+
+        return [self._network_score([localscores[f] for f in netfamilies], net)
+                for net,netfamilies in zip(networks, families)]
+
+    def _family_scores(self, families):
+        # localscores of families (as tuples of node and parents)
+        return [(f, self._localscore(f[0], list(f[1:]))) for f in families]
+
+    def _family_cached(self, family):
+        return family in self.localscore_cache
+
+    def _cache_family_scores(self, scores):
+        # keep the (family, localscore) pairs scored in another process
+        for family,score in scores:
+            self.localscore_cache.store(family, score)
+
+    def _network_score(self, localscores, net):
+        # score of net (not the evaluator's network) given its localscores
+        return sum(localscores) + self.prior.loglikelihood(net)
+
+    def add_variables(self, observations, missing=None, interventions=None,
+                      variables=None, prior_=None):
+        """Add variables to the data and network and rescore the network.
+
+        The first four arguments are those of Dataset.add_variables. The new
+        variables are added to the network as unconnected nodes. The data of
+        the existing families doesn't change, so their cached localscores are
+        reused.
+
+        prior_ should be the prior for the network with the new nodes. If not
+        specified, the evaluator's prior is kept; this only works with a
+        NullPrior since other priors depend on the number of nodes.
+
+        """
+
+        self._add_variables(observations, missing, interventions, variables,
+                            prior_)
+        return self.score_network()
     
     def randomize_network(self): 
         """Randomize the network edges."""
@@ -185,7 +528,11 @@ class SmartNetworkEvaluator(NetworkEvaluator):
             * randomize_network
             * clear_network
 
-        The last change applied can be 'undone' with restore_network
+        Changes can be 'undone' with restore_network. Up to
+        evaluator.undo_depth changes are remembered.
+
+        Changes can also be scored without being made with score_move. Moves
+        that are accepted can then be committed with apply_move.
 
         """
 
@@ -199,33 +546,149 @@ class SmartNetworkEvaluator(NetworkEvaluator):
 
         # these represent that state that we intelligently manage
         self.localscores = N.zeros((self.data.variables.size), dtype=float)
+        self.localscore_sum = 0.0
+        self.priorstate = None
         self.dirtynodes = set(self.datavars)
-        self.saved_state = None
+        self.undo_depth = config.get('evaluator.undo_depth')
+        self.racing_subsample = config.get('evaluator.racing_subsample')
+        self.racing_confidence = config.get('evaluator.racing_confidence')
+        self._racing_rows = None
+        self.undo_log = deque()
+        self._changedscores = None
 
     #
     # Private Interface
     #
+    def _priorscore(self):
+        # the prior is scored incrementally (see prior.PriorState)
+        if self.priorstate is None:
+            self.priorstate = self.prior.state(self.network)
+        return self.priorstate.loglikelihood()
+
+    def _effective_changes(self, add, remove):
+        # edges that alter_network(add, remove) actually removes and adds
+        # (ignoring duplicates, removal of missing edges, etc)
+        edges = self.network.edges
+        removed, added = [], []
+        removed_set, added_set = set(), set()
+
+        for edge in remove:
+            edge = tuple(edge)
+            if edge in edges and edge not in removed_set:
+                removed.append(edge)
+                removed_set.add(edge)
+
+        for edge in add:
+            edge = tuple(edge)
+            if (edge in removed_set or edge not in edges) and \
+               edge not in added_set:
+                added.append(edge)
+                added_set.add(edge)
+
+        return added, removed
+
+    def _new_parents(self, add, remove):
+        # the parents (as sets) of the nodes whose parents change
+        parents = self.network.edges.parents
+        newparents = dict((n, set(parents(n))) for n in unzip(add+remove, 1))
+        for src,dest in remove:
+            newparents[dest].discard(src)
+        for src,dest in add:
+            newparents[dest].add(src)
+        return newparents
+
+    def _family_loglikelihoods(self, node, parents, rows):
+        # log probability of the node's value in each of the rows given its
+        # parents' values, with parameters estimated from these rows (with a
+        # pseudocount of 1). Rows where the node was intervened upon get 0.
+        observations = self.data.observations
+        arities = [self.data.variables[v].arity for v in [node] + parents]
+        ri, qi = arities[0], int(N.product(arities[1:]))
+        
+        multipliers = N.multiply.accumulate([1] + arities[1:-1])
+        j = N.dot(observations[rows][:,parents], multipliers).astype(int) \
+                if parents else N.zeros(len(rows), dtype=int)
+        k = observations[rows,node].astype(int)
+        observed = ~self.data.interventions[rows,node]
+
+        counts = N.bincount((j*ri + k)[observed], minlength=qi*ri)
+        counts = counts.reshape((qi,ri)) + 1.0
+        params = N.log(counts / counts.sum(axis=1)[:,N.newaxis])
+        
+        return N.where(observed, params[j,k], 0.0), (ri-1) * qi
+
+    def add_variables(self, observations, missing=None, interventions=None,
+                      variables=None, prior_=None):
+        """Add variables to the data and network and rescore the network.
+
+        See NetworkEvaluator.add_variables. Only the new nodes are scored (the
+        localscores of the existing nodes don't change). Changes made before
+        the variables were added can't be undone with restore_network.
+
+        """
+
+        newdata = self._add_variables(observations, missing, interventions, 
+                                      variables, prior_)
+        numvars = newdata.variables.size
+        self.localscores = N.concatenate((self.localscores, N.zeros(numvars)))
+        self.dirtynodes.update(self.datavars[-numvars:])
+        self.priorstate = None
+        self.undo_log.clear()
+        self.score = self._score_network_core()
+        return self.score
+
+    def _rescore_data(self):
+        # rescore all nodes after the data changed. The saved localscores
+        # are for the old data, so earlier changes can't be undone.
+        self.dirtynodes = set(self.datavars)
+        self.undo_log.clear()
+        self._racing_rows = None
+        self.score = self._score_network_core()
+        return self.score
+
+    def _cycle_candidates(self, add):
+        # the added edges that could create a cycle. If the network has no
+        # edges that the prior disallows, edges between nodes that the prior
+        # orders (see Prior.precedes) cannot be part of a cycle.
+        priorstate = self.priorstate
+        if not add or priorstate is None or priorstate.violations:
+            return add
+
+        precedes = self.prior.precedes
+        return [(src,dest) for src,dest in add if not precedes(src, dest)]
+
     def _backup_state(self, added, removed):
-        self.saved_state = (
+        # Only the localscores that change are saved (by _score_network_core
+        # into the changedscores list), so backing up state does not depend on
+        # the size of the network.
+        self._changedscores = []
+        self.undo_log.append((
             self.score,                     # saved score
-            #[(n,self.localscores[n]) for n in self.dirtynodes],
-            self.localscores.copy(),        # saved localscores
+            self.localscore_sum,            # saved sum of localscores
+            self._changedscores,            # saved (node, localscore) pairs
+            set(self.dirtynodes),           # nodes that were already dirty
             added,                          # edges added
             removed                         # edges removed
-        )
+        ))
+
+        if len(self.undo_log) > self.undo_depth:
+            self.undo_log.popleft()
 
     def _restore_state(self):
-        if self.saved_state:
-            self.score, self.localscores, added, removed = self.saved_state
-            #self.score, changedscores, added, removed = self.saved_state
+        if not self.undo_log:
+            return
+
+        self.score, self.localscore_sum, changedscores, self.dirtynodes, \
+            added, removed = self.undo_log.pop()
         
-        #for n,score in changedscores:
-            #self.localscores[n] = score
+        for node,score in reversed(changedscores):
+            self.localscores[node] = score
 
-        self.network.edges.add_many(removed)
         self.network.edges.remove_many(added)
-        self.saved_state = None
-        self.dirtynodes = set()
+        self.network.edges.add_many(removed)
+        if self.priorstate is not None:
+            self.priorstate.update(add=removed, remove=added)
+        self._changedscores = None
 
     def _score_network_core(self):
         # if no nodes are dirty, just return last score.
@@ -234,11 +697,17 @@ class SmartNetworkEvaluator(NetworkEvaluator):
 
         # update localscore for dirtynodes, then re-calculate globalscore
         parents = self.network.edges.parents
+        localscores = self.localscores
+        changedscores = self._changedscores
         for node in self.dirtynodes:
-            self.localscores[node] = self._localscore(node, parents(node))
+            oldscore = localscores[node]
+            localscores[node] = self._localscore(node, parents(node))
+            self.localscore_sum += localscores[node] - oldscore
+            if changedscores is not None:
+                changedscores.append((node, oldscore))
         
         self.dirtynodes = set()
-        self.score = self._globalscore(self.localscores)
+        self.score = self.localscore_sum + self._priorscore()
 
         return self.score
 
@@ -273,12 +742,13 @@ class SmartNetworkEvaluator(NetworkEvaluator):
         # NOTE: remove existing edges *before* adding new ones. 
         #   if edge e is in `add`, `remove` and `self.network`, 
         #   it should exist in the new network. (the add and remove cancel out.
+        add, remove = self._effective_changes(add, remove)
         self.network.edges.remove_many(remove)
         self.network.edges.add_many(add)    
 
         # check whether changes lead to valid DAG (raise error if they don't)
-        affected_nodes = set(unzip(add, 1))
-        if affected_nodes and not self.network.is_acyclic(affected_nodes):
+        affected_nodes = set(unzip(self._cycle_candidates(add), 1))
+        if affected_nodes and not self._is_acyclic(affected_nodes):
             self.network.edges.remove_many(add)
             self.network.edges.add_many(remove)
             raise CyclicNetworkError()
@@ -288,12 +758,147 @@ class SmartNetworkEvaluator(NetworkEvaluator):
         #   1) determine dirtynodes
         #   2) backup state
         #   3) score network (but only rescore dirtynodes)
-        self._update_dirtynodes(add, remove)
         self._backup_state(add, remove)
+        if self.priorstate is not None:
+            self.priorstate.update(add, remove)
+        self._update_dirtynodes(add, remove)
         self.score = self._score_network_core()
+        self._changedscores = None
 
         return self.score
        
+    def score_move(self, add=[], remove=[]):
+        """Score a change to the network without making it.
+
+        Returns the change in score that alter_network(add, remove) would
+        cause. Only the nodes whose parents change are rescored (using the
+        localscore cache) and the network is left untouched, so a rejected
+        move does not need to be undone with restore_network.
+
+        The move is not checked for cycles; apply_move does that when the move
+        is committed. Moves that the prior rules out (prohibited edges, edge
+        constraints, degree limits) are rejected before any localscores are
+        computed.
+
+        """
+
+        # make sure that localscores are up to date
+        self._score_network_core()
+
+        add, remove = self._effective_changes(add, remove)
+        priorscore = self.priorstate.loglikelihood_after(add, remove)
+        if priorscore == prior.NEGINF:
+            return 0.0 if self.priorstate.loglikelihood() == prior.NEGINF \
+                       else prior.NEGINF
+
+        localscores = self.localscores
+        oldscore = self.localscore_sum + self.priorstate.loglikelihood()
+        newscore = self.localscore_sum + priorscore
+        for node,pset in self._new_parents(add, remove).iteritems():
+            newscore += self._localscore(node, sorted(pset)) - localscores[node]
+
+        # a move between two invalid (-inf) networks does not change the score
+        if newscore == oldscore:
+            return 0.0
+        return newscore - oldscore
+
+    def race_move(self, add=[], remove=[], minscore=prior.NEGINF):
+        """Check, using subsamples of the data, whether a change is promising.
+
+        Returns False if the network after alter_network(add, remove) would
+        (with high confidence) score below minscore, and True otherwise. Moves
+        that pass the check should then be scored with the full data. 
+        
+        The change in the score of each family whose parents change is
+        estimated from the average change in the per-sample loglikelihood on
+        a random subsample of evaluator.racing_subsample samples, scaled to the
+        full dataset (with a BIC-like correction for the change in the number
+        of parameters). The parameters are estimated from the same subsample,
+        which overstates the fit of the larger family, so the average is first
+        corrected by half the change in the number of parameters per sample
+        (as in AIC). A move is rejected when the upper confidence bound
+        (evaluator.racing_confidence standard errors) of the estimated score
+        is below minscore. Otherwise, the subsample is doubled and the move
+        rechecked (successive halving) until the subsample would be half of
+        the data.
+
+        This is only an approximation to the score used by this evaluator, so
+        moves rejected this way can occasionally be ones that would have been
+        accepted. If evaluator.racing_subsample is 0 or the data has missing
+        values, every move is promising.
+
+        """
+
+        numsamples = self.data.samples.size
+        subsample = self.racing_subsample
+        if not subsample or 2*subsample > numsamples or self.data.has_missing:
+            return True
+
+        self._score_network_core()
+        add, remove = self._effective_changes(add, remove)
+        priorscore = self.priorstate.loglikelihood_after(add, remove)
+        if priorscore == prior.NEGINF:
+            return minscore == prior.NEGINF
+        
+        # the samples are used in the same random order so that the
+        # subsamples are nested
+        if self._racing_rows is None:
+            self._racing_rows = N.random.permutation(numsamples)
+
+        parents = self.network.edges.parents
+        newparents = self._new_parents(add, remove)
+        currentscore = self.localscore_sum + priorscore
+        
+        while 2*subsample <= numsamples:
+            rows = self._racing_rows[:subsample]
+            changes = N.zeros(subsample)
+            numparams = 0
+            for node,pset in newparents.iteritems():
+                new, newparams = self._family_loglikelihoods(node, sorted(pset), rows)
+                old, oldparams = self._family_loglikelihoods(node, parents(node), rows)
+                changes += new - old
+                numparams += newparams - oldparams
+            
+            # estimated change in score and its upper confidence bound (the
+            # fit to the subsample overstates the expected loglikelihood by
+            # about numparams/2 and the fit to the full data by the same)
+            estimate = numsamples * (changes.mean() - numparams/(2.0*subsample)) \
+                       + numparams * (1 - log(numsamples)) / 2.0
+            stderr = numsamples * changes.std() / N.sqrt(subsample)
+            upperbound = currentscore + estimate + \
+                         self.racing_confidence * stderr
+
+            if upperbound < minscore:
+                return False
+            subsample *= 2
+
+        return True
+
+    def append_data(self, observations, missing=None, interventions=None,
+                    samples=None):
+        """Append samples to the data and rescore the network.
+
+        See NetworkEvaluator.append_data. All localscores change, so changes
+        made before the samples were appended can't be undone with
+        restore_network.
+
+        """
+
+        newdata = self.data.append(observations, missing, interventions, samples)
+        self.localscore_cache.update(newdata)
+        return self._rescore_data()
+
+    def apply_move(self, add=[], remove=[]):
+        """Commit a change that was scored with score_move.
+
+        This is alter_network: the change is checked for cycles, the affected
+        nodes are rescored (their scores are already in the localscore cache)
+        and the change can be undone with restore_network.
+
+        """
+
+        return self.alter_network(add, remove)
+
     def randomize_network(self):
         """Randomize the network edges."""
 
@@ -311,15 +916,427 @@ class SmartNetworkEvaluator(NetworkEvaluator):
         Undo the last change performed by any of these methods:
             * score_network
             * alter_network
+            * apply_move
             * randomize_network
             * clear_network
 
+        Calling this repeatedly undoes earlier changes, up to
+        evaluator.undo_depth changes back. Once there is nothing left to undo,
+        the network and score are left unchanged.
+
         """
 
         self._restore_state()
         return self.score
 
 
+class NeighborhoodTable(object):
+    """Score changes for every single-edge move from the current network.
+
+    deltas[i,j] is the change in score from removing the edge i->j if it
+    exists or from adding it otherwise. Reversing an existing edge i->j
+    changes the score by deltas[i,j] + deltas[j,i]. The entries in column j
+    only depend on the parents of node j, so after a move is applied only the
+    columns of the nodes whose parents changed need to be recomputed (see
+    update). A steepest-ascent search then costs O(n) localscore computations
+    per step instead of O(n**2).
+
+    Entries include the local score change and the edge-local part of the
+    prior (see Prior.edge_loglikelihood), so moves with disallowed edges score
+    -inf. Degree limits are checked with Prior.allows_move when choosing the
+    best move. If the prior has custom constraints, the best move is verified
+    with SmartNetworkEvaluator.score_move. The best move is selected from the
+    deltas with numpy, so only the moves that score better than it (and
+    create cycles or aren't allowed by the prior) are checked in python.
+
+    All changes to the network must be made through the evaluator's methods
+    and update (or refresh) must be called after each change.
+
+    """
+
+    def __init__(self, evaluator_):
+        if not isinstance(evaluator_, SmartNetworkEvaluator) or \
+           isinstance(evaluator_, MissingDataNetworkEvaluator):
+            msg = "NeighborhoodTable requires a SmartNetworkEvaluator " + \
+                  "and complete data."
+            raise Exception(msg)
+
+        self.evaluator = evaluator_
+        num_nodes = len(evaluator_.datavars)
+        self.deltas = N.zeros((num_nodes, num_nodes), dtype=float)
+        self.refresh()
+
+    #
+    # Private Interface
+    #
+    def _update_column(self, node):
+        ev = self.evaluator
+        edge_loglikelihood = ev.prior.edge_loglikelihood
+        parents = set(ev.network.edges.parents(node))
+        current = ev.localscores[node]
+        column = self.deltas[:,node]
+
+        for src in ev.datavars:
+            if src == node:
+                column[src] = prior.NEGINF
+            elif src in parents:
+                column[src] = ev._localscore(node, sorted(parents - set([src]))) \
+                              - current - edge_loglikelihood(src, node)
+            else:
+                column[src] = ev._localscore(node, sorted(parents | set([src]))) \
+                              - current + edge_loglikelihood(src, node)
+
+    def _move_deltas(self):
+        # the deltas of removing, reversing and adding each edge i->j (as a
+        # 3 x n x n array) and whether each of these moves exists
+        deltas = self.deltas
+        edges = self.edges
+        absent = ~(edges | edges.T)
+        N.fill_diagonal(absent, False)
+
+        valid = N.array([edges, edges, absent])
+        movedeltas = N.array([deltas, deltas + deltas.T, deltas])
+        movedeltas[N.isnan(movedeltas)] = prior.NEGINF
+        movedeltas[~valid] = prior.NEGINF
+        return movedeltas, valid
+
+    def _move(self, index):
+        # the move at index of the flattened _move_deltas as (add, remove)
+        kind,src,dest = N.unravel_index(index, (3,) + self.deltas.shape)
+        if kind == 0:
+            return [], [(src,dest)]
+        elif kind == 1:
+            return [(dest,src)], [(src,dest)]
+        return [(src,dest)], []
+
+    def _ranked_moves(self):
+        # (delta, add, remove) of the existing moves, best move first. The
+        # best few are found with argpartition and the rest are only sorted
+        # if all of those are rejected.
+        movedeltas, valid = self._move_deltas()
+        indices = N.flatnonzero(valid)
+        values = -movedeltas.ravel()[indices]
+        if not len(indices):
+            return
+
+        count = min(32, len(indices))
+        best = N.argpartition(values, count - 1)[:count]
+        rest = N.ones(len(indices), dtype=bool)
+        rest[best] = False
+        rest = N.flatnonzero(rest)
+
+        for group in (best, rest):
+            for i in group[N.argsort(values[group], kind='mergesort')]:
+                add, remove = self._move(indices[i])
+                yield -values[i], add, remove
+
+    def _creates_cycle(self, add, remove):
+        candidates = self.evaluator._cycle_candidates(add)
+        if not candidates:
+            return False
+
+        net = self.evaluator.network
+        net.edges.remove_many(remove)
+        net.edges.add_many(add)
+        acyclic = self.evaluator._is_acyclic(unzip(candidates, 1))
+        net.edges.remove_many(add)
+        net.edges.add_many(remove)
+        return not acyclic
+
+    #
+    # Public Interface
+    #
+    def refresh(self):
+        """Recompute all entries (for example, after randomize_network)."""
+
+        self.evaluator._score_network_core()
+        self.edges = self.evaluator.network.edges.adjacency_matrix
+        for node in self.evaluator.datavars:
+            self._update_column(node)
+
+    def update(self, add=[], remove=[]):
+        """Update entries after the given change was applied to the network."""
+
+        self.evaluator._score_network_core()
+        for src,dest in remove:
+            self.edges[src,dest] = False
+        for src,dest in add:
+            self.edges[src,dest] = True
+        for node in set(unzip(add+remove, 1)):
+            self._update_column(node)
+
+    def moves(self):
+        """Returns all single-edge moves as a list of (delta, add, remove).
+
+        The list is sorted by delta, best move first. Moves that would create
+        cycles are included. This sorts all O(n**2) moves, so use best_move
+        to find the best one.
+
+        """
+
+        return list(self._ranked_moves())
+
+    def best_move(self):
+        """Returns the best move that leads to a valid DAG.
+
+        The move is returned as (delta, add, remove) or None if there are no
+        valid moves.
+
+        """
+
+        ev = self.evaluator
+        verify = ev.prior.constraints
+        for delta,add,remove in self._ranked_moves():
+            if not ev.prior.allows_move(ev.network, add, remove):
+                continue
+            if add and self._creates_cycle(add, remove):
+                continue
+            if verify:
+                delta = ev.score_move(add, remove)
+            return delta, add, remove
+
+        return None
+
+
+class SlidingWindowNetworkEvaluator(SmartNetworkEvaluator):
+    #
+    # Parameters
+    # 
+    _params = (
+        config.IntParameter(
+            'window.size',
+            """Number of most recent samples scored by the
+            SlidingWindowNetworkEvaluator. Specify 0 to use the number of
+            samples in the initial data.""",
+            config.atleast(0),
+            default=0
+        ),
+    )
+
+    def __init__(self, data_, network_, prior_=None, localscore_cache=None,
+                 **options):
+        """Create a network evaluator for a window over a stream of samples.
+
+        The evaluator scores networks with the most recent window.size
+        samples. New samples are added with append_data and the oldest samples
+        then expire. The window is kept as a ring buffer: once it is full, the
+        new samples overwrite the expired ones in place (see
+        Dataset.replace_samples), so the samples aren't in the order they
+        arrived. The localscore cache keeps the cpds (and count tables) of
+        the families it has scored and updates them by counting only the
+        samples that arrive and expire, so moving the window and rescoring
+        the network after each batch of samples costs O(batch) instead of
+        O(window.size) per family. Every cached family is updated, so
+        localscore_cache.maxsize also bounds the cost of each update.
+
+        The window is a copy of the last window.size samples of data_, which
+        is not changed.
+
+        Any config param for 'window' can be passed in via options.
+        Use just the option part of the parameter name.
+
+        """
+
+        config.setparams(self, options)
+        numsamples = data_.samples.size
+        self.size = self.size or numsamples
+        window = data_.subset(samples=range(max(numsamples - self.size, 0), 
+                                            numsamples))
+        
+        super(SlidingWindowNetworkEvaluator, self).__init__(window, network_,
+                                                            prior_,
+                                                            localscore_cache)
+        self.localscore_cache.keep_cpds = True
+
+        # row of the oldest sample (once the window is full)
+        self._oldest = 0
+
+    def append_data(self, observations, missing=None, interventions=None,
+                    samples=None):
+        """Add samples to the window and rescore the network.
+
+        The arguments are those of Dataset.append. The oldest samples expire
+        so that the window has (at most) window.size samples. Changes made
+        before the window moved can't be undone with restore_network.
+
+        """
+
+        batch = (observations, missing, interventions, samples)
+        rows = lambda start, stop: [a if a is None else N.asarray(a)[start:stop] 
+                                    for a in batch]
+
+        # samples that would expire within the batch are skipped
+        numnew = len(observations)
+        skipped = max(numnew - self.size, 0)
+        numfree = min(max(self.size - self.data.samples.size, 0), 
+                      numnew - skipped)
+
+        # fill the window, then replace its oldest samples
+        if numfree:
+            newdata = self.data.append(*rows(skipped, skipped + numfree))
+            self.localscore_cache.update(newdata)
+        if numnew > skipped + numfree:
+            replaced = (self._oldest + N.arange(numnew - skipped - numfree)) \
+                            % self.size
+            newdata, olddata = self.data.replace_samples(
+                replaced, *rows(skipped + numfree, numnew))
+            self.localscore_cache.update(newdata, olddata)
+            self._oldest = (replaced[-1] + 1) % self.size
+
+        return self._rescore_data()
+
+
+class PooledNetworkEvaluator(SmartNetworkEvaluator):
+    #
+    # Parameters
+    # 
+    _params = (
+        config.StringParameter(
+            'pooled.mode',
+            """How the datasets are scored by the PooledNetworkEvaluator:
+                * joint: as one dataset; the counts for each family are
+                  summed over the datasets
+                * separate: as separate experiments with their own
+                  parameters; the localscores are summed over the datasets""",
+            config.oneof('joint', 'separate'),
+            default='joint'
+        ),
+    )
+
+    def __init__(self, datasets, network_, prior_=None, localscore_cache=None,
+                 **options):
+        """Create a network evaluator for several datasets.
+
+        datasets should be a list of Dataset instances with the same
+        variables (and the same arity for each variable) and no missing
+        values. Networks are scored
+        with the pooled data (see pooled.mode) without merging the datasets
+        (as data.merge would). The cpds of each family are kept for each
+        dataset, so only those for a dataset that changes (see
+        replace_dataset and append_data) need to be recomputed. As many cpds
+        are kept for each dataset as localscores are cached (see
+        localscore_cache.maxsize), the least recently used ones are discarded.
+
+        Moves are not screened with race_move.
+
+        Any config param for 'pooled' can be passed in via options.
+        Use just the option part of the parameter name.
+
+        """
+
+        config.setparams(self, options)
+        self.datasets = list(datasets)
+        if len(set(d.variables.size for d in self.datasets)) > 1:
+            raise Exception("Datasets must have the same variables.")
+        for i,d in enumerate(self.datasets):
+            self._check_missing(d.missing, i)
+            if i:
+                self._check_arities(d, i)
+
+        super(PooledNetworkEvaluator, self).__init__(self.datasets[0], network_,
+                                                     prior_, localscore_cache)
+        self._datasetcpds = [OrderedDict() for d in self.datasets]
+        
+        # summing counts requires the python implementation of the cpd
+        self._cpdtype = cpd.MultinomialCPD_Py if self.mode == 'joint' \
+                            else cpd.MultinomialCPD
+
+    def _check_arities(self, data_, index):
+        # counts can only be pooled if the variables have the same values
+        for v,v0 in zip(data_.variables, self.datasets[0].variables):
+            if v.arity != v0.arity:
+                msg = "Variable %s has arity %d in dataset %d but %d in dataset 0." % \
+                      (v0.name, v.arity, index, v0.arity)
+                raise Exception(msg)
+
+    def _check_missing(self, missing, index):
+        # the cpds count every value, including missing ones
+        if missing is not None and N.asarray(missing).any():
+            msg = "Dataset %d has missing values, which can't be pooled." % index
+            raise Exception(msg)
+
+    def _datasetcpd(self, index, variables):
+        # the cpd for a family in one of the datasets (kept in a LRU cache
+        # with the same maxsize as the localscore cache)
+        cache = self._datasetcpds[index]
+        key = tuple(variables)
+        try:
+            cpd_ = cache.pop(key)
+        except KeyError:
+            cpd_ = self._cpdtype(self.datasets[index]._subset_ni_fast(variables))
+            maxsize = self.localscore_cache.cachesize
+            if maxsize > 0 and len(cache) >= maxsize:
+                cache.popitem(last=False)
+        cache[key] = cpd_
+        return cpd_
+
+    def _cpd(self, node, parents):
+        variables = [node] + parents
+        cpds = [self._datasetcpd(i, variables) for i in xrange(len(self.datasets))]
+        if self.mode == 'joint':
+            return cpd.PooledMultinomialCPD(cpds)
+        return cpd.ProductCPD(cpds)
+
+    def _install_timers(self):
+        # the cpds are built for each dataset, so time those instead
+        super(PooledNetworkEvaluator, self)._install_timers()
+        del self._cpd
+        if not isinstance(self._datasetcpd, _Timed):
+            self._datasetcpd = _Timed(self.stats, 'cpt', self._datasetcpd)
+
+    def race_move(self, add=[], remove=[], minscore=prior.NEGINF):
+        """Moves are not screened with pooled data, so every move is promising."""
+        return True
+
+    def replace_dataset(self, index, data_):
+        """Replace one of the datasets and rescore the network.
+
+        Only the cpds for the replaced dataset are recomputed. Changes made
+        before the dataset was replaced can't be undone with restore_network.
+
+        """
+
+        self._check_missing(data_.missing, index)
+        self._check_arities(data_, index)
+        self.datasets[index] = data_
+        self._datasetcpds[index] = OrderedDict()
+        if index == 0:
+            self.data = data_
+
+        # all pooled localscores change
+        self.localscore_cache.clear()
+        return self._rescore_data()
+
+    def append_data(self, observations, missing=None, interventions=None,
+                    samples=None, index=0):
+        """Append samples to one of the datasets and rescore the network.
+
+        The samples are appended to datasets[index] (see Dataset.append) and
+        only the new samples are added to the cpds for that dataset. The
+        samples can't have missing values.
+
+        """
+
+        self._check_missing(missing, index)
+        newdata = self.datasets[index].append(observations, missing, 
+                                              interventions, samples)
+        for key,cpd_ in self._datasetcpds[index].iteritems():
+            cpd_.add_data(newdata._subset_ni_fast(list(key)).observations)
+
+        self.localscore_cache.clear()
+        return self._rescore_data()
+
+    def add_variables(self, observations, missing=None, interventions=None,
+                      variables=None, prior_=None):
+        """Not supported with several datasets.
+
+        Add the variables to each dataset and create a new evaluator instead.
+
+        """
+
+        raise Exception("Cannot add variables to pooled datasets.")
+
+
 class GibbsSamplerState(object):
     """Represents the state of the Gibbs sampler.
 
@@ -368,6 +1385,50 @@ class MissingDataNetworkEvaluator(SmartNetworkEvaluator):
                 * 100   (for 100 iterations)
             """,
             default="n**2"
+        ),
+        config.IntParameter(
+            'gibbs.chains',
+            """Number of independent chains to run. With more than one chain,
+            sampling stops once the chains have converged (see gibbs.rhat) or
+            after gibbs.max_iterations iterations of each chain.""",
+            config.atleast(1),
+            default=1
+        ),
+        config.FloatParameter(
+            'gibbs.rhat',
+            """Chains have converged once the Gelman-Rubin statistic (R-hat)
+            of their sampled scores is below this value.""",
+            default=1.1
+        ),
+        config.StringParameter(
+            'gibbs.chain_execution',
+            """How to run multiple chains. Choices include:
+                * parallel: each chain runs in its own process (if os.fork
+                            is available)
+                * serial: the chains take turns in this process
+            """,
+            config.oneof('parallel', 'serial'),
+            default='parallel'
+        ),
+        config.StringParameter(
+            'gibbs.start',
+            """Starting values for the missing values when scoring a network
+            that differs from the previously scored one. Choices include:
+                * warm: continue from the values sampled for the previous
+                        network, with a shorter burn-in (see gibbs.reburnin).
+                        Only used with a single chain.
+                * random: start from random values (with a full burn-in)
+            """,
+            config.oneof('warm', 'random'),
+            default='warm'
+        ),
+        config.IntParameter(
+            'gibbs.reburnin',
+            """Burn-in period for a warm-started gibbs sampler (specified as a
+            multiple of the number of missing values whose families have
+            changed since the previous network was scored)""",
+            config.atleast(0),
+            default=2
         )
     )
 
@@ -385,38 +1446,70 @@ class MissingDataNetworkEvaluator(SmartNetworkEvaluator):
                Microsoft Technical Report MSR-TR-95-06, 1995. p.21-22.
 
        
+        Only the families (a node and its parents) that include a variable
+        with missing values are scored by sampling. The other families don't
+        depend on the missing values, so they are scored with the localscore
+        cache as in SmartNetworkEvaluator. Changes to the network that only
+        affect such families don't require sampling at all.
+
         Any config param for 'gibbs' can be passed in via options.
         Use just the option part of the parameter name.
 
         """
 
         super(MissingDataNetworkEvaluator, self).__init__(data_, network_,
-                                                         prior_)
-        self._localscore = None  # no cache w/ missing data
+                                                         prior_, 
+                                                         localscore_cache)
         config.setparams(self, options)
+
+        # variables with missing values and the families that include them 
+        # (as a dict of node -> parents) 
+        self.missing_indices = unzip(N.where(self.data.missing==True))
+        self.missingvars = set(N.where(self.data.missing.any(axis=0))[0])
+        self.missingfamilies = {}
+        
+        # sampled score of the families with missing values (a log average)
+        self.missingscore = None
+        self.gibbs_state = None
+        self._resample = False
+        self._resume = False
+        self.missing_undo_log = deque()
+
+        # variables in families with missing values that have changed since
+        # the last sampling (to size the burn-in of warm-started samplers)
+        self._changedvars = set()
+        self._missingcounts = self.data.missing.sum(axis=0)
         
     def _init_state(self):
         parents = self.network.edges.parents
 
-        self.cpds = [self._cpd(n, parents(n)) for n in self.datavars]
-        self.localscores = N.array([cpd.loglikelihood() for cpd in self.cpds], dtype=float)
-        self.data_dirtynodes = set(self.datavars)
+        self.cpds = dict((n, self._cpd(n, parents(n))) for n in self.missingfamilies)
+        self.samplescores = N.zeros(len(self.datavars), dtype=float)
+        self.data_dirtynodes = set(self.cpds)
+
+    def _touches_missing(self, node, parents):
+        return node in self.missingvars or \
+               any(p in self.missingvars for p in parents)
 
-	def _update_dirtynodes(self, add, remove):
-		# With hidden nodes:
-		# 	1. dirtynode calculation is more expensive (need to look beyond 
-		#      markov blanket).
-		# 	2. time spent rescoring observed nodes is insignificant compared 
-		#      to scoring hidden/missing nodes.
-		self.dirtynodes = set(self.datavars)
+    def _backup_state(self, added, removed):
+        super(MissingDataNetworkEvaluator, self)._backup_state(added, removed)
+        self.missing_undo_log.append((self.missingscore, 
+                                      dict(self.missingfamilies)))
+        if len(self.missing_undo_log) > self.undo_depth:
+            self.missing_undo_log.popleft()
+
+    def _restore_state(self):
+        if self.missing_undo_log:
+            self.missingscore, self.missingfamilies = self.missing_undo_log.pop()
+        super(MissingDataNetworkEvaluator, self)._restore_state()
 
     def _score_network_with_tempdata(self):
         # update localscore for data_dirtynodes, then calculate globalscore.
         for n in self.data_dirtynodes:
-            self.localscores[n] = self.cpds[n].loglikelihood()
+            self.samplescores[n] = self.cpds[n].loglikelihood()
 
         self.data_dirtynodes = set()
-        self.score = self._globalscore(self.localscores)
+        self.score = self.localscore_sum + self._globalscore(self.samplescores)
         return self.score
 
     def _alter_data(self, row, col, value):
@@ -439,24 +1532,21 @@ class MissingDataNetworkEvaluator(SmartNetworkEvaluator):
         self._alter_data(row, col, value)
         return self._score_network_with_tempdata()
 
-    def _calculate_score(self, chosenscores, gibbs_state):
-        # discard the burnin period scores and average the rest
-        burnin_period = self.burnin * \
-                        self.data.missing[self.data.missing==True].size
-
+    def _calculate_score(self, chainscores, gibbs_state, burnin_period):
+        # discard the burnin period scores of each chain and average the rest
         if gibbs_state:
             # resuming from a previous gibbs run. so, no burnin required.
-            scoresum = logsum(N.concatenate((chosenscores, [gibbs_state.scoresum])))
-            numscores = len(chosenscores) + gibbs_state.numscores
-        elif len(chosenscores) > burnin_period:
+            scoresum = logsum(N.concatenate(chainscores + [[gibbs_state.scoresum]]))
+            numscores = sum(len(s) for s in chainscores) + gibbs_state.numscores
+        elif len(chainscores[0]) > burnin_period:
             # remove scores from burnin period.
-            nonburn_scores = chosenscores[burnin_period:]
+            nonburn_scores = N.concatenate([s[burnin_period:] for s in chainscores])
             scoresum = logsum(nonburn_scores)
             numscores = len(nonburn_scores)
         else:
             # this occurs when gibbs iterations were less than burnin period.
-            scoresum = chosenscores[-1]
-            numscores = 1
+            scoresum = logsum([s[-1] for s in chainscores])
+            numscores = len(chainscores)
         
         score = scoresum - log(numscores)
         return score, numscores
@@ -478,6 +1568,11 @@ class MissingDataNetworkEvaluator(SmartNetworkEvaluator):
 
         The default stopping criteria is to run for n**2 iterations.
 
+        Unless gibbs.start is 'random', the sampler continues from the values
+        sampled for the previously scored network, so only the missing values
+        whose families have changed need to burn in again (see
+        gibbs.reburnin).
+
         gibbs_state is the state of a previous run of the Gibb's sampler.  With
         this, one can do the following::
         
@@ -499,44 +1594,278 @@ class MissingDataNetworkEvaluator(SmartNetworkEvaluator):
             )
 
         """
-        self.gibbs_state = gibbs_state
+        if gibbs_state is not None:
+            self.gibbs_state = gibbs_state
+        self._resample = self._resume = gibbs_state is not None
         return super(MissingDataNetworkEvaluator, self).score_network(net)
 
+    def score_move(self, add=[], remove=[]):
+        """Score a change to the network without keeping it.
+
+        With missing data, localscores can't be reused across networks, so the
+        change is made, scored and then undone. Unlike
+        SmartNetworkEvaluator.score_move, this raises CyclicNetworkError if the
+        change creates a cycle.
+
+        """
+
+        if self.score is None:
+            self.score_network()
+
+        oldscore = self.score
+        newscore = self.alter_network(add, remove)
+        self.restore_network()
+
+        if newscore == oldscore:
+            return 0.0
+        return newscore - oldscore
+
+    def append_data(self, observations, missing=None, interventions=None,
+                    samples=None):
+        """Not supported with missing data.
+
+        The sampler's state depends on the samples with missing values, so a
+        new evaluator must be created for the grown dataset.
+
+        """
+
+        msg = "Cannot append samples to data scored with missing values."
+        raise Exception(msg)
+
+    def add_variables(self, observations, missing=None, interventions=None,
+                      variables=None, prior_=None):
+        """Not supported with missing data.
+
+        The sampler's state depends on the variables with missing values, so
+        a new evaluator must be created for the grown dataset.
+
+        """
+
+        msg = "Cannot add variables to data scored with missing values."
+        raise Exception(msg)
+
+    def score_networks(self, networks, processes=1):
+        """Score several networks.
+
+        Families with missing values are scored by sampling for each network,
+        so the networks are scored (and the evaluator's network changed) one
+        at a time with score_network and processes is ignored.
+
+        """
+
+        return [self.score_network(net) for net in networks]
+
     def _score_network_core(self):
-        # create some useful lists and local variables
-        missing_indices = unzip(N.where(self.data.missing==True))
-        num_missingvals = len(missing_indices)
-        n = num_missingvals
-        max_iterations = eval(self.max_iterations)
-        arities = [v.arity for v in self.data.variables]
-        chosenscores = []
+        # rescore the dirty families without missing values with the cache
+        # and note which families with missing values have changed.
+        parents = self.network.edges.parents
+        localscores = self.localscores
+        changedscores = self._changedscores
+        resample = self._resample or self.missingscore is None
 
-        self._assign_missingvals(missing_indices, self.gibbs_state)
+        for node in self.dirtynodes:
+            nodeparents = parents(node)
+            oldscore = localscores[node]
+            oldparents = self.missingfamilies.get(node)
+            if self._touches_missing(node, nodeparents):
+                localscores[node] = 0.0
+                if oldparents != tuple(nodeparents):
+                    self.missingfamilies[node] = tuple(nodeparents)
+                    self._changedvars.update([node] + nodeparents)
+                    self._changedvars.update(oldparents or [])
+                    resample = True
+            else:
+                localscores[node] = self._localscore(node, nodeparents)
+                if oldparents is not None:
+                    del self.missingfamilies[node]
+                    self._changedvars.update((node,) + oldparents)
+                    resample = True
+
+            self.localscore_sum += localscores[node] - oldscore
+            if changedscores is not None:
+                changedscores.append((node, oldscore))
+
+        self.dirtynodes = set()
+        self._resample = False
+
+        # no need to sample for networks that the prior rules out
+        if self._priorscore() == prior.NEGINF:
+            self.missingscore = None
+            self.score = prior.NEGINF
+            return self.score
+
+        # only sample if the families with missing values have changed
+        if resample:
+            if self.missingfamilies:
+                self.missingscore = self._score_missing_families() - \
+                                    self.localscore_sum - self._priorscore()
+            else:
+                self.missingscore = 0.0
+
+        self.score = self.localscore_sum + self.missingscore + self._priorscore()
+        return self.score
+
+    def _init_sampler(self, gibbs_state):
+        # assign initial values to the missing values and create the cpds
+        self._assign_missingvals(self.missing_indices, gibbs_state)
         self._init_state()
 
+    def _markov_blanket(self, col):
+        # the families whose cpds change when a value of col changes: col's
+        # and its children's, as (node, datacols, cpd) tuples
+        parents = self.network.edges.parents
+        return [(node, [node] + parents(node), self.cpds[node]) 
+                for node in [col] + self.network.edges.children(col)]
+
+    def _replace_value(self, row, col, value, families):
+        # change a value in the data and update the cpds of the given families
+        # (see _markov_blanket)
+        observations = self.data.observations
+        interventions = self.data.interventions
+        oldrow = observations[row].copy()
+        observations[row,col] = value
+        newrow = observations[row]
+        for node,datacols,cpd_ in families:
+            if not interventions[row,node]:
+                cpd_.replace_data(oldrow[datacols], newrow[datacols])
+
+    def _sweep(self):
         # Gibbs Sampling: 
         # For each missing value:
         #    1) score net with each possible value (based on node's arity)
         #    2) using a probability wheel, sample a value from the possible values
-        iters = 0
-        while iters < max_iterations:
-            for row,col in missing_indices:
-                scores = [self._alter_data_and_score(row, col, val) \
-                             for val in xrange(arities[col])]
-                chosenval = logscale_probwheel(range(len(scores)), scores)
-                self._alter_data(row, col, chosenval)
-                chosenscores.append(scores[chosenval])
+        #
+        # The network doesn't change during a sweep, so the prior and the
+        # localscores of families without missing values are constant. Only
+        # the families in the missing value's markov blanket are rescored.
+        arities = [v.arity for v in self.data.variables]
+        interventions = self.data.interventions
+        samplescores = self.samplescores
+        blankets = {}
+
+        self._score_network_with_tempdata()
+        constscore = self.localscore_sum + self._priorscore()
+        samplesum = N.sum(samplescores)
+
+        chosenscores = []
+        for row,col in self.missing_indices:
+            if col not in blankets:
+                blankets[col] = self._markov_blanket(col)
+            families = [f for f in blankets[col] if not interventions[row,f[0]]]
+            oldlocal = sum(samplescores[node] for node,datacols,cpd_ in families)
+            restscore = constscore + samplesum - oldlocal
+
+            scores, localscores = [], []
+            for val in xrange(arities[col]):
+                self._replace_value(row, col, val, families)
+                localscores.append([cpd_.loglikelihood() for node,datacols,cpd_ in families])
+                scores.append(restscore + sum(localscores[-1]))
+
+            chosenval = logscale_probwheel(range(len(scores)), scores)
+            if chosenval != val:
+                self._replace_value(row, col, chosenval, families)
+            
+            for (node,datacols,cpd_),score in zip(families, localscores[chosenval]):
+                samplescores[node] = score
+            samplesum += sum(localscores[chosenval]) - oldlocal
+            chosenscores.append(scores[chosenval])
+
+        return chosenscores
+
+    def _missingvals(self):
+        # current values of the missing values
+        return self.data.observations[unzip(self.missing_indices)].tolist()
+
+    def _run_chains(self, max_iterations, gibbs_state, burnin_period):
+        # Run multiple chains, one sweep at a time, until they converge or
+        # have run max_iterations iterations. The first chain starts from
+        # gibbs_state (if given).
+        num_missingvals = len(self.missing_indices)
+
+        if self.chain_execution == 'parallel' and hasattr(os, 'fork'):
+            chaintype = _ForkedGibbsChain
+        else:
+            chaintype = _GibbsChain
+        chains = [chaintype(self, gibbs_state if i == 0 else None) \
+                    for i in xrange(self.chains)]
+
+        try:
+            chainscores = [[] for chain in chains]
+            iters = 0
+            while iters < max_iterations or not chainscores[0]:
+                for chain in chains:
+                    chain.start_sweep()
+                for scores,chain in zip(chainscores, chains):
+                    scores.extend(chain.finish_sweep())
+                iters += num_missingvals
             
-            iters += num_missingvals
+                # have the chains converged?
+                if len(chainscores[0]) - burnin_period >= 2 and \
+                   gelman_rubin([s[burnin_period:] for s in chainscores]) < self.rhat:
+                    break
+
+            # continue with the values from the first chain
+            assignedvals = chains[0].missingvals()
+        finally:
+            # chains can share pipes (through fork), so close all before
+            # waiting for any to finish
+            for chain in chains:
+                chain.close()
+            for chain in chains:
+                chain.join()
+
+        self.data.observations[unzip(self.missing_indices)] = assignedvals
+        return chainscores, assignedvals
+
+    def _score_missing_families(self):
+        # create some useful lists and local variables
+        n = len(self.missing_indices)
+        max_iterations = eval(self.max_iterations)
+        burnin_period = self.burnin * n
+
+        # resuming a previous run (see score_network) requires no burnin.
+        resume_state = self.gibbs_state if self._resume else None
+        start_state = resume_state
+        self._resume = False
+
+        if resume_state:
+            burnin_period = 0
+        elif self.gibbs_state and self.start == 'warm' and self.chains == 1:
+            # Consecutive networks usually differ in an edge or two, so
+            # continue from the values sampled for the previous network (still
+            # in the data). Only the missing values whose families changed
+            # need to burn in again, so fewer iterations are needed.
+            numchanged = sum(self._missingcounts[v] for v in self._changedvars)
+            reburnin_period = min(self.reburnin * numchanged, burnin_period)
+            max_iterations -= burnin_period - reburnin_period
+            burnin_period = reburnin_period
+            start_state = GibbsSamplerState(
+                avgscore=None, numscores=0, assignedvals=self._missingvals()
+            )
+        self._changedvars = set()
 
-        self.chosenscores = N.array(chosenscores)
-        self.score, numscores = self._calculate_score(self.chosenscores, self.gibbs_state)
+        if self.chains > 1:
+            chainscores, assignedvals = self._run_chains(
+                max_iterations, start_state, burnin_period)
+        else:
+            self._init_sampler(start_state)
+            chosenscores = []
+            iters = 0
+            while iters < max_iterations or not chosenscores:
+                chosenscores.extend(self._sweep())
+                iters += n
+            chainscores = [chosenscores]
+            assignedvals = self._missingvals()
+
+        self.chosenscores = N.concatenate(chainscores)
+        self.score, numscores = self._calculate_score(
+            chainscores, resume_state, burnin_period)
 
         # save state of gibbs sampler
         self.gibbs_state = GibbsSamplerState(
             avgscore=self.score, 
             numscores=numscores, 
-            assignedvals=self.data.observations[unzip(missing_indices)].tolist()
+            assignedvals=assignedvals
         )
 
         return self.score
@@ -549,36 +1878,100 @@ class MissingDataExactNetworkEvaluator(MissingDataNetworkEvaluator):
     missing values.  Since this is a combinatorial space, this class is only
     feasible with datasets with few missing values.
 
-    """
+    The enumeration can be split across exact.processes processes (if os.fork
+    is available); each scores an equal share of the completions.
 
-    def _score_network_core(self):
-        """Score a network.
-
-        If net is provided, scores that. Otherwise, score network previously
-        set.
+    """
 
-        Note: See MissingDataNetworkEvaluator.score_network for more information
-        about arguments.
+    #
+    # Parameters
+    #
+    _params = MissingDataNetworkEvaluator._params + (
+        config.IntParameter(
+            'exact.processes',
+            """Number of processes that enumerate the completions of the
+            missing values (when os.fork is available). Set this to the number
+            of available cores to speed up the exact missing data evaluator.""",
+            config.atleast(1),
+            default=1
+        ),
+    )
 
-        """
-        
+    def _shards(self, arities):
+        # Split the completions into shards by fixing the values of the last
+        # few missing values (those that change least often in Gray code
+        # order). Use a few shards per process so that processes get similar
+        # numbers of completions.
+        numshards = 4 * self.processes
+        fixed = 0
+        while fixed < len(arities) and \
+              N.product(arities[len(arities)-fixed:]) < numshards:
+            fixed += 1
+
+        if not fixed:
+            return [()]
+        return list(cartesian_product([range(a) for a in arities[-fixed:]]))
+
+    def _enumerate(self, arities, shards):
+        # Score all completions in the given shards and return the sum of their
+        # scores (in log space) as (maxscore, sum of exp(score-maxscore),
+        # number of scores).
+        missing_indices = self.missing_indices
+        numfree = len(arities) - len(shards[0])
+        maxscore, scoresum, numscores = None, 0.0, 0
+
+        for fixedvals in shards:
+            # Enumerate through all possible values for the free missing values
+            # in Gray code order, so that only one missing value changes (and
+            # only its family and its children's families are rescored)
+            # between completions. The scores are summed as we go.
+            for (row,col),val in zip(missing_indices, [0]*numfree + list(fixedvals)):
+                self._alter_data(row, col, val)
+            score = self._score_network_with_tempdata()
+
+            changes = gray_code_product(arities[:numfree])
+            while True:
+                if maxscore is None:
+                    maxscore, scoresum = score, 1.0
+                elif score > maxscore:
+                    scoresum = scoresum * exp(maxscore - score) + 1.0
+                    maxscore = score
+                else:
+                    scoresum += exp(score - maxscore)
+                numscores += 1
+
+                try:
+                    i,val = changes.next()
+                except StopIteration:
+                    break
+                row,col = missing_indices[i]
+                score = self._alter_data_and_score(row, col, val)
+
+        return maxscore, scoresum, numscores
+
+    def _score_missing_families(self):
         # create some useful lists and local variables
-        missing_indices = unzip(N.where(self.data.missing==True))
-        num_missingvals = len(missing_indices)
-        possiblevals = [range(self.data.variables[col].arity) for row,col in missing_indices]
+        arities = [self.data.variables[col].arity for row,col in self.missing_indices]
+        shards = self._shards(arities)
 
         self._init_state()
         
-        # Enumerate through all possible values for the missing data (using
-        # the cartesian_product function) and score.
-        scores = []
-        for assignedvals in cartesian_product(possiblevals):
-            for (row,col),val in zip(missing_indices, assignedvals):
-                self._alter_data(row, col, val)
-            scores.append(self._score_network_with_tempdata())
+        if self.processes > 1 and len(shards) > 1 and hasattr(os, 'fork'):
+            # give each process a contiguous range of shards
+            bounds = N.linspace(0, len(shards), self.processes + 1).astype(int)
+            tasks = [_ForkedTask(self._enumerate, arities, shards[start:stop])
+                     for start,stop in zip(bounds[:-1], bounds[1:]) 
+                     if stop > start]
+            results = [task.result() for task in tasks]
+        else:
+            results = [self._enumerate(arities, shards)]
 
         # average score (in log space)
-        self.score = logsum(scores) - log(len(scores))
+        maxscore = max(r[0] for r in results)
+        scoresum = sum(r[1] * exp(r[0] - maxscore) for r in results)
+        numscores = sum(r[2] for r in results)
+
+        self.score = maxscore + log(scoresum) - log(numscores)
         return self.score
 
 
@@ -627,76 +2020,561 @@ class MissingDataMaximumEntropyNetworkEvaluator(MissingDataNetworkEvaluator):
                 self._do_maximum_entropy_assignment(var)
  
 
-    def _swap_data(self, var, sample1, choices_for_sample2):
-        val1 = self.data.observations[sample1, var]
-        
-        # try swapping till we get a different value (but don't keep trying
-        # forever)
-        for i in xrange(len(choices_for_sample2)/2):
-            sample2 = random.choice(choices_for_sample2)
-            val2 = self.data.observations[sample2, var]
-            if val1 != val2:
-                break
-
-        self._alter_data(sample1, var, val2)
-        self._alter_data(sample2, var, val1)
-        
-        return (sample1, var, val1, sample2, var, val2)
-    
-    def _undo_swap(self, row1, col1, val1, row2, col2, val2):
-        self._alter_data(row1, col1, val1)
-        self._alter_data(row2, col2, val2) 
-
-    def _score_network_core(self):
-        # create some useful lists and counts
-        num_missingvals = self.data.missing[self.data.missing == True].shape[0]
-        n = num_missingvals
-        max_iterations = eval(self.max_iterations)
-        chosenscores = []
-        
+    def _init_sampler(self, gibbs_state):
         # determine missing vars and samples
-        missingvars = [v for v in self.datavars if self.data.missing[:,v].any()]
-        missingsamples = [N.where(self.data.missing[:,v] == True)[0] \
-                            for v in self.datavars]
+        self.missingvarlist = [v for v in self.datavars if self.data.missing[:,v].any()]
+        self.missingsamples = [N.where(self.data.missing[:,v] == True)[0] \
+                                 for v in self.datavars]
 
-        self._assign_missingvals(missingvars, self.gibbs_state)
+        self._assign_missingvals(self.missingvarlist, gibbs_state)
         self._init_state()
 
-        # iteratively swap data randomly amond samples of a var and score
-        iters = 0
-        while iters < max_iterations:
-            for var in missingvars:  
-                for sample in missingsamples[var]:
-                    score0 = self._score_network_with_tempdata()
-                    swap = self._swap_data(var, sample, missingsamples[var]) 
-                    score1 = self._score_network_with_tempdata()
-                    chosenval = logscale_probwheel([0,1], [score0, score1])
-                    
-                    if chosenval == 0:
-                        self._undo_swap(*swap)
-                        chosenscores.append(score0)
-                    else:
-                        chosenscores.append(score1)
-
-            iters += num_missingvals
-
-        self.chosenscores = N.array(chosenscores)
-        self.score, numscores = self._calculate_score(self.chosenscores, self.gibbs_state)
+    def _sweep(self):
+        # Iteratively swap the values of two missing samples of a var and
+        # either keep or undo the swap (based on the scores with and without
+        # the swap). 
+        # 
+        # Partners are drawn from the samples with a different value (kept in
+        # per-value pools), so every proposal is a real change. As with Gibbs
+        # sampling, only the families in the var's markov blanket change.
+        observations = self.data.observations
+        interventions = self.data.interventions
+        samplescores = self.samplescores
+
+        self._score_network_with_tempdata()
+        constscore = self.localscore_sum + self._priorscore()
+        samplesum = N.sum(samplescores)
+
+        chosenscores = []
+        for var in self.missingvarlist:  
+            samples = self.missingsamples[var]
+            blanket = self._markov_blanket(var)
+            
+            # pools of samples by value and each sample's position in its pool
+            values = observations[samples, var]
+            pools = [list(samples[values == val]) 
+                     for val in xrange(self.data.variables[var].arity)]
+            position = dict((sample, i) for pool in pools 
+                                        for i,sample in enumerate(pool))
+
+            for sample,draw in zip(samples, N.random.random(len(samples))):
+                score0 = constscore + samplesum
+                val1 = observations[sample, var]
+                numothers = len(samples) - len(pools[val1])
+                if not numothers:
+                    chosenscores.append(score0)
+                    continue
+
+                # draw a partner uniformly from the samples with other values
+                k = int(draw * numothers)
+                for val2,pool in enumerate(pools):
+                    if val2 != val1:
+                        if k < len(pool):
+                            break
+                        k -= len(pool)
+                sample2 = pool[k]
+
+                families = [f for f in blanket 
+                            if not (interventions[sample,f[0]] and 
+                                    interventions[sample2,f[0]])]
+                oldlocal = sum(samplescores[node] for node,datacols,cpd_ in families)
+
+                self._replace_value(sample, var, val2, families)
+                self._replace_value(sample2, var, val1, families)
+                localscores = [cpd_.loglikelihood() for node,datacols,cpd_ in families]
+                score1 = score0 - oldlocal + sum(localscores)
+
+                if logscale_probwheel([0,1], [score0, score1]) == 0:
+                    self._replace_value(sample, var, val1, families)
+                    self._replace_value(sample2, var, val2, families)
+                    chosenscores.append(score0)
+                else:
+                    for (node,datacols,cpd_),score in zip(families, localscores):
+                        samplescores[node] = score
+                    samplesum += score1 - score0
+
+                    i, j = position[sample], position[sample2]
+                    pools[val1][i], pools[val2][j] = sample2, sample
+                    position[sample], position[sample2] = j, i
+                    chosenscores.append(score1)
+
+        return chosenscores
+
+
+class _GibbsChain(object):
+    # A chain of a MissingDataNetworkEvaluator's sampler run in this process.
+    # Chains share the evaluator's data and cpds, so the chain's values for
+    # the missing values are restored before every sweep.
+    
+    def __init__(self, evaluator_, gibbs_state):
+        self.evaluator = evaluator_
+        evaluator_._init_sampler(gibbs_state)
+        self.values = evaluator_._missingvals()
+
+    def start_sweep(self):
+        ev = self.evaluator
+        ev.data.observations[unzip(ev.missing_indices)] = self.values
+        ev._init_state()
+        self.scores = ev._sweep()
+        self.values = ev._missingvals()
+
+    def finish_sweep(self):
+        return self.scores
+
+    def missingvals(self):
+        return self.values
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class _ForkedGibbsChain(object):
+    # A chain of a MissingDataNetworkEvaluator's sampler run in a child
+    # process. The child is forked with a copy of the evaluator and sweeps
+    # whenever asked to (over a pipe). Sweeps of different chains run
+    # concurrently between start_sweep and finish_sweep.
+
+    def __init__(self, evaluator_, gibbs_state):
+        cmd_read, cmd_write = os.pipe()
+        reply_read, reply_write = os.pipe()
+
+        self.pid = os.fork()
+        if self.pid == 0:
+            os.close(cmd_write)
+            os.close(reply_read)
+            self._serve(evaluator_, gibbs_state, os.fdopen(cmd_read, 'rb'),
+                        os.fdopen(reply_write, 'wb'))
+
+        os.close(cmd_read)
+        os.close(reply_write)
+        self.commands = os.fdopen(cmd_write, 'wb')
+        self.replies = os.fdopen(reply_read, 'rb')
+
+    def _serve(self, evaluator_, gibbs_state, commands, replies):
+        # runs in the child process and never returns
+        status = 0
+        try:
+            # don't use the same random numbers as the other chains
+            random.seed()
+            N.random.seed()
+
+            evaluator_._init_sampler(gibbs_state)
+            while True:
+                command = cPickle.load(commands)
+                if command == 'sweep':
+                    reply = evaluator_._sweep()
+                else:
+                    reply = evaluator_._missingvals()
+                
+                cPickle.dump(reply, replies, 2)
+                replies.flush()
+                if command == 'stop':
+                    break
+        except EOFError:
+            # parent closed the pipe without stopping this chain
+            status = 1
+        except:
+            traceback.print_exc()
+            status = 1
+
+        os._exit(status)
+
+    def _request(self, command):
+        cPickle.dump(command, self.commands, 2)
+        self.commands.flush()
+
+    def _reply(self):
+        try:
+            return cPickle.load(self.replies)
+        except EOFError:
+            raise Exception("Gibbs sampler chain (process %d) failed." % self.pid)
+
+    def start_sweep(self):
+        self._request('sweep')
+
+    def finish_sweep(self):
+        return self._reply()
+
+    def missingvals(self):
+        self._request('stop')
+        return self._reply()
+
+    def close(self):
+        self.commands.close()
+        self.replies.close()
+
+    def join(self):
+        os.waitpid(self.pid, 0)
+
+
+class _ForkedTask(object):
+    # Calls func(*args) in a child process. The child is forked with a copy of
+    # this process (so, of the evaluator) and sends back the result over a
+    # pipe.
+
+    def __init__(self, func, *args):
+        reply_read, reply_write = os.pipe()
+
+        self.pid = os.fork()
+        if self.pid == 0:
+            os.close(reply_read)
+            status = 0
+            try:
+                replies = os.fdopen(reply_write, 'wb')
+                cPickle.dump(func(*args), replies, 2)
+                replies.close()
+            except:
+                traceback.print_exc()
+                status = 1
+            os._exit(status)
+
+        os.close(reply_write)
+        self.replies = os.fdopen(reply_read, 'rb')
+
+    def result(self):
+        try:
+            return cPickle.load(self.replies)
+        except EOFError:
+            raise Exception("Forked task (process %d) failed." % self.pid)
+        finally:
+            self.replies.close()
+            os.waitpid(self.pid, 0)
+
+
+class MissingDataStructuralEMNetworkEvaluator(SmartNetworkEvaluator):
+    #
+    # Parameters
+    #
+    _params = (
+        config.IntParameter(
+            'sem.estep_interval',
+            """Number of changes to the network (that are not undone with
+            restore_network) between recalculations of the expected
+            counts.""",
+            config.atleast(1),
+            default=10
+        ),
+    )
+
+    def __init__(self, data_, network_, prior_=None, localscore_cache=None, 
+                 **options): 
+        """Create a network evaluator that uses structural EM for missing values.
+
+        Instead of sampling completions of the missing values for every
+        network, this evaluator calculates the expected counts (sufficient
+        statistics) of the data under the current network (the E-step) and
+        scores networks with these counts. As with complete data, only the
+        families (a node and its parents) that change are rescored and their
+        scores are cached. Families without missing values are scored with
+        the localscore cache.
+
+        The expected counts are recalculated after every sem.estep_interval
+        changes to the network and when expectation_step is called. The
+        counts are initially based on random weights for the completions, to
+        break the symmetry between the values of hidden variables.
+
+        The completions of each sample are enumerated, so this is only
+        feasible when each sample has a few missing values (for example, a
+        single hidden variable).
+
+        For more information about structural EM, consult:
+
+            1. N. Friedman. The Bayesian Structural EM Algorithm. Proceedings
+               of the 14th Conference on Uncertainty in Artificial
+               Intelligence, 1998. p.129-138.
+
+        Any config param for 'sem' can be passed in via options.
+        Use just the option part of the parameter name.
+
+        """
+
+        super(MissingDataStructuralEMNetworkEvaluator, self).__init__(
+            data_, network_, prior_, localscore_cache)
+        config.setparams(self, options)
+
+        self.missingvars = set(N.where(self.data.missing.any(axis=0))[0])
+        self.arities = [v.arity for v in self.data.variables]
+
+        # families are scored with _familyscore instead of the cache (a bound
+        # method in __dict__ would keep the evaluator from being pickled)
+        del self._localscore
+
+        # scores of the families with missing values for the current
+        # expected counts, an offset that keeps scores comparable across
+        # E-steps and the number of changes since the last E-step.
+        self.expectedscores = {}
+        self.score_offset = 0.0
+        self.changes = 0
+
+        self._init_completions()
+
+    #
+    # Private Interface
+    #
+    def _init_completions(self):
+        # Every sample with missing values is expanded into all of its
+        # completions, each with a weight. Samples without missing values are
+        # included once with a weight of 1.
+        observations = self.data.observations
+        missing = self.data.missing
+        completed, origins, weights = [], [], []
+        self.blocks = []
+
+        numrows = 0
+        for row in xrange(observations.shape[0]):
+            cols = N.where(missing[row])[0]
+            if not len(cols):
+                completed.append(observations[row:row+1])
+                origins.append([row])
+                weights.append([1.0])
+                numrows += 1
+                continue
+
+            values = N.array(list(cartesian_product(
+                        [range(self.arities[c]) for c in cols])))
+            rows = N.repeat(observations[row:row+1], len(values), axis=0)
+            rows[:,cols] = values
+
+            completed.append(rows)
+            origins.append([row] * len(values))
+            weights.append(normalize(N.random.random(len(values))))
+            self.blocks.append((row, numrows, numrows + len(values), cols))
+            numrows += len(values)
+
+        self.completed = N.concatenate(completed)
+        self.origins = N.concatenate(origins)
+        self.weights = N.concatenate(weights)
+
+    def _touches_missing(self, node, parents):
+        return node in self.missingvars or \
+               any(p in self.missingvars for p in parents)
+
+    def _family_index(self, values, parents):
+        # index of the parent configurations in values (a completed-data matrix)
+        multipliers = N.multiply.accumulate([1] + [self.arities[p] for p in parents[:-1]])
+        return N.dot(values[:,parents], multipliers) if parents else \
+               N.zeros(len(values), dtype=int)
+
+    def _expected_counts(self, node, parents):
+        # expected counts of the family's configurations as a matrix of
+        # parent configurations by node values
+        rows = N.where(self.data.interventions[self.origins, node] == False)[0]
+        values = self.completed[rows]
+        arity = self.arities[node]
+        numconfigs = int(N.product([self.arities[p] for p in parents]))
         
-        # save state of gibbs sampler
-        self.gibbs_state = GibbsSamplerState(
-            avgscore=self.score, 
-            numscores=numscores, 
-            assignedvals=self.data.observations[
-                N.where(self.data.missing==True)
-            ].tolist()
-        )
+        index = self._family_index(values, parents) * arity + values[:,node]
+        counts = N.bincount(index, self.weights[rows], minlength=numconfigs*arity)
+        return counts.reshape((numconfigs, arity))
+
+    def _localscore(self, node, parents):
+        return self._familyscore(node, parents)
+
+    def _familyscore(self, node, parents):
+        # used in place of the localscore cache
+        if not self._touches_missing(node, parents):
+            return self.localscore_cache(node, parents)
         
+        index = tuple([node] + parents)
+        try:
+            return self.expectedscores[index]
+        except KeyError:
+            # the multinomial cpd's loglikelihood with expected counts (in
+            # place of log factorials of counts, use log gamma functions)
+            counts = self._expected_counts(node, parents)
+            arity = counts.shape[1]
+            score = N.sum(
+                lgamma(arity) 
+                - _lngamma(counts.sum(axis=1) + arity) 
+                + N.sum(_lngamma(counts + 1), axis=1)
+            )
+            self.expectedscores[index] = score
+            return score
+
+    def _score_network_core(self):
+        if len(self.dirtynodes) == 0:
+            return self.score
+
+        super(MissingDataStructuralEMNetworkEvaluator, self)._score_network_core()
+        self.score += self.score_offset
+        return self.score
+
+    def _family_cached(self, family):
+        if self._touches_missing(family[0], family[1:]):
+            return family in self.expectedscores
+        return family in self.localscore_cache
+
+    def _cache_family_scores(self, scores):
+        for family,score in scores:
+            if self._touches_missing(family[0], family[1:]):
+                self.expectedscores[family] = score
+            else:
+                self.localscore_cache.store(family, score)
+
+    def _network_score(self, localscores, net):
+        return super(MissingDataStructuralEMNetworkEvaluator, 
+                     self)._network_score(localscores, net) + self.score_offset
+
+    #
+    # Public Interface
+    #
+    def expectation_step(self):
+        """Recalculate the expected counts under the current network.
+
+        The probability of each completion of a sample's missing values is
+        calculated using the parameters of the current network (estimated
+        from the current expected counts). 
+
+        The score of the current network is left unchanged but the scores of
+        changes to it are based on the new expected counts. Changes made
+        before the E-step can no longer be undone with restore_network.
+
+        """
+
+        oldscore = self._score_network_core()
+        parents = self.network.edges.parents
+        children = self.network.edges.children
+        interventions = self.data.interventions
+
+        # log of the parameters of the families with missing values
+        logparams = {}
+        for node in self.datavars:
+            nodeparents = parents(node)
+            if self._touches_missing(node, nodeparents):
+                counts = self._expected_counts(node, nodeparents)
+                logparams[node] = N.log(
+                    (counts + 1.0) / 
+                    (counts.sum(axis=1) + self.arities[node])[:,N.newaxis]
+                )
+
+        # reweight the completions of each sample with missing values
+        for row,start,stop,cols in self.blocks:
+            values = self.completed[start:stop]
+            logprobs = N.zeros(stop - start)
+            
+            affected = set(cols)
+            for col in cols:
+                affected.update(children(col))
+            
+            for node in affected:
+                if not interventions[row,node]:
+                    index = self._family_index(values, parents(node))
+                    logprobs += logparams[node][index, values[:,node]]
+
+            self.weights[start:stop] = normalize(N.exp(logprobs - logprobs.max()))
+
+        # rescore families with missing values
+        self.expectedscores = {}
+        self.undo_log.clear()
+        self._changedscores = None
+        self.changes = 0
+        self.dirtynodes = set(n for n in self.datavars 
+                                if self._touches_missing(n, parents(n)))
+        newscore = self._score_network_core()
+
+        # keep the score of the current network
+        if N.isfinite(oldscore) and N.isfinite(newscore):
+            self.score_offset += oldscore - newscore
+            self.score = oldscore
+
         return self.score
 
+    def alter_network(self, add=[], remove=[]):
+        """Alter the network while retaining the ability to *quickly* undo the changes.
+
+        If sem.estep_interval changes have been made since the last E-step,
+        the expected counts are recalculated first (see expectation_step).
+
+        """
+
+        if self.changes >= self.estep_interval:
+            self.expectation_step()
+
+        changed = any(self._effective_changes(add, remove))
+        score = super(MissingDataStructuralEMNetworkEvaluator, 
+                      self).alter_network(add, remove)
+        if changed:
+            self.changes += 1
+        return score
+
+    def restore_network(self):
+        if self.undo_log and any(self.undo_log[-1][-2:]):
+            self.changes = max(self.changes - 1, 0)
+        return super(MissingDataStructuralEMNetworkEvaluator, 
+                     self).restore_network()
+    restore_network.__doc__ = SmartNetworkEvaluator.restore_network.__doc__
+
+    def append_data(self, observations, missing=None, interventions=None,
+                    samples=None):
+        """Not supported with missing data.
+
+        The completions of the samples with missing values and their weights
+        are built for the initial samples, so a new evaluator must be created
+        for the grown dataset.
+
+        """
+
+        msg = "Cannot append samples to data scored with missing values."
+        raise Exception(msg)
+
+    def add_variables(self, observations, missing=None, interventions=None,
+                      variables=None, prior_=None):
+        """Not supported with missing data.
+
+        The completions of the samples with missing values are built for the
+        initial variables, so a new evaluator must be created for the grown
+        dataset.
+
+        """
+
+        msg = "Cannot add variables to data scored with missing values."
+        raise Exception(msg)
+
+
+# log gamma function for arrays
+_lngamma = lambda x: N.frompyfunc(lgamma, 1, 1)(x).astype(float)
+
 #
 # Parameters
 #
+_pundodepth = config.IntParameter(
+    'evaluator.undo_depth',
+    """Number of changes to the network that SmartNetworkEvaluator
+    remembers and can undo with restore_network.""",
+    config.atleast(1),
+    default=100
+)
+
+_pracingsubsample = config.IntParameter(
+    'evaluator.racing_subsample',
+    """Number of samples used by SmartNetworkEvaluator.race_move to screen
+    out unpromising moves before scoring them with all samples (learners
+    that propose random moves use this). Specify 0 to score all moves with
+    all samples.""",
+    config.atleast(0),
+    default=0
+)
+
+_pracingconfidence = config.FloatParameter(
+    'evaluator.racing_confidence',
+    """Number of standard errors that the estimated score of a move
+    (from a subsample) must be below the score it needs to reach for
+    SmartNetworkEvaluator.race_move to reject it.""",
+    config.atleast(0.0),
+    default=3.0
+)
+
+_pinstrument = config.IntParameter(
+    'evaluator.instrument',
+    """Set to 1 to time the phases of scoring networks (see
+    EvaluatorStats). The times are saved with the learner's results.""",
+    config.between(0, 1),
+    default=0
+)
+
 _pmissingdatahandler = config.StringParameter(
     'evaluator.missingdata_evaluator',
     """
@@ -707,15 +2585,19 @@ _pmissingdatahandler = config.StringParameter(
           variables.  
         * exact: exact enumeration of all possible missing values (only
                  useable when there are few missing values)
+        * sem: structural EM, scoring networks with the expected counts
+               under the current network (only useable when each sample
+               has few missing values)
     """,
-    config.oneof('gibbs', 'exact', 'maxentropy_gibbs'),
+    config.oneof('gibbs', 'exact', 'maxentropy_gibbs', 'sem'),
     default='gibbs'
 )
 
 _missingdata_evaluators = {
     'gibbs': MissingDataNetworkEvaluator,
     'exact': MissingDataExactNetworkEvaluator,
-    'maxentropy_gibbs': MissingDataMaximumEntropyNetworkEvaluator
+    'maxentropy_gibbs': MissingDataMaximumEntropyNetworkEvaluator,
+    'sem': MissingDataStructuralEMNetworkEvaluator
 }
 
 def fromconfig(data_=None, network_=None, prior_=None):
@@ -728,11 +2610,15 @@ def fromconfig(data_=None, network_=None, prior_=None):
 
     data_ = data_ or data.fromconfig()
     network_ = network_ or network.fromdata(data_)
-    prior_ = prior_ or prior.fromconfig()
+    prior_ = prior_ or prior.fromconfig(data_)
 
     if data_.missing.any():
         e = _missingdata_evaluators[config.get('evaluator.missingdata_evaluator')]
-        return e(data_, network_, prior_)
+        evaluator_ = e(data_, network_, prior_)
     else:
-        return SmartNetworkEvaluator(data_, network_, prior_)
+        evaluator_ = SmartNetworkEvaluator(data_, network_, prior_)
+
+    if config.get('evaluator.instrument'):
+        evaluator_.instrument()
+    return evaluator_
 
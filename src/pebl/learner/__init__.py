@@ -3,11 +3,13 @@ from pebl import config, data, prior
 #TODO: test
 def fromconfig(data_=None, prior_=None):
     learnertype = config.get('learner.type')
+    data_ = data_ or data.fromconfig()
+    prior_ = prior_ or prior.fromconfig(data_)
 
     if ':' in learnertype:
         CustomLearner(
-            data_ or data.fromconfig(), 
-            prior_ or prior.fromconfig(),
+            data_, 
+            prior_,
             learnerurl=learnertype
         )
     else:
@@ -15,5 +17,5 @@ def fromconfig(data_=None, prior_=None):
         mymod = __import__("pebl.learner.%s" % learnermodule, fromlist=['pebl.learner'])
 
     mylearner = getattr(mymod, learnerclass)
-    return mylearner(data_ or data.fromconfig(), prior_ or prior.fromconfig())
+    return mylearner(data_, prior_)
 
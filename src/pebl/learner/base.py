@@ -33,9 +33,16 @@ _ptasks = config.IntParameter(
 
 
 class Learner(Task):
-    def __init__(self, data_=None, prior_=None, **kw):
+    def __init__(self, data_=None, prior_=None, evaluator_=None, **kw):
+        # a learner given an evaluator continues from its network and reuses
+        # its cached localscores (see _create_evaluator)
+        if evaluator_ is not None:
+            data_ = data_ or evaluator_.data
+            prior_ = prior_ or evaluator_.prior
+        self.seed_evaluator = evaluator_
+
         self.data = data_ or data.fromconfig()
-        self.prior = prior_ or prior.fromconfig()
+        self.prior = prior_ or prior.fromconfig(self.data)
         self.__dict__.update(kw)
 
         # parameters
@@ -45,13 +52,32 @@ class Learner(Task):
         self.reverse = 0
         self.add = 0
         self.remove = 0
+        self.raced = 0
+
+    def _create_evaluator(self, seed):
+        # the evaluator given to the learner or a new one for the seed
+        if self.seed_evaluator is not None:
+            self.evaluator = self.seed_evaluator
+        else:
+            self.evaluator = evaluator.fromconfig(self.data, seed, self.prior)
+        self.evaluator.score_network(seed.copy())
+        return self.evaluator
+
+    def _alter_network_randomly_and_score(self, minscore=None):
+        """Make a random change to the network and score it.
+
+        If minscore is given, the evaluator first checks (with
+        evaluator.race_move) whether the change could score at least minscore.
+        If not, the network is left unchanged and None is returned.
+
+        """
 
-    def _alter_network_randomly_and_score(self):
         net = self.evaluator.network
         n_nodes = self.data.variables.size
         max_attempts = n_nodes**2
 
         # continue making changes and undoing them till we get an acyclic network
+        # that the prior allows
         for i in xrange(max_attempts):
             node1, node2 = N.random.random_integers(0, n_nodes-1, 2)    
         
@@ -61,10 +87,23 @@ class Learner(Task):
             elif (node2, node1) in net.edges:
                 # node2 -> node1 exists, so remove it
                 add,remove = [], [(node2, node1)]
+            elif self.evaluator.prior.precedes(node2, node1):
+                # node1 and node2 unconnected but the prior orders node2 first
+                add,remove =  [(node2, node1)], []
             else:
                 # node1 and node2 unconnected, so connect them
                 add,remove =  [(node1, node2)], []
+
+            # moves ruled out by the prior's edge-local constraints are
+            # rejected without scoring them
+            if not self.evaluator.prior.allows_move(net, add, remove):
+                continue
             
+            if minscore is not None and \
+               not self.evaluator.race_move(add, remove, minscore):
+                self.raced += 1
+                return None
+
             try:
                 score = self.evaluator.alter_network(add=add, remove=remove)
             except evaluator.CyclicNetworkError:
@@ -62,9 +62,10 @@ class CustomLearner(Learner):
         custlearner = getattr(mod, self.learner_class)
 
         # run the custom learner
+        data_ = self.data or data.fromconfig()
         clearn = custlearner(
-            self.data or data.fromconfig(), 
-            self.prior or prior.fromconfig(),
+            data_,
+            self.prior or prior.fromconfig(data_),
             **self.kw
         )
         self.result = clearn.run()
@@ -43,10 +43,20 @@ class GreedyLearner(Learner):
             'greedy.seed',
             'Starting network for a greedy search.',
             default=''
+        ),
+        config.StringParameter(
+            'greedy.search',
+            """How local changes are chosen. Choices include:
+                * random: make a random change and keep it if the score
+                  improves
+                * steepest: make the change that improves the score the most
+                  and restart when no change improves it""",
+            config.oneof('random', 'steepest'),
+            default='random'
         )
     )
 
-    def __init__(self, data_=None, prior_=None, **options):
+    def __init__(self, data_=None, prior_=None, evaluator_=None, **options):
         """
         Create a learner that uses a greedy learning algorithm.
 
@@ -58,9 +68,19 @@ class GreedyLearner(Learner):
             4. Steps 2-3 are repeated till the restarting_criteria is met, at
                which point we begin again with a new random network (step 1)
         
+        With search='steepest', step 2 makes the change that improves the
+        score the most instead (using an evaluator.NeighborhoodTable) and a
+        restart happens as soon as no change improves the score.
+
         Any config param for 'greedy' can be passed in via options.
         Use just the option part of the parameter name.
 
+        If evaluator_ (a network evaluator) is specified, the learner scores
+        networks with it (and its data and prior) and starts from its network
+        unless a seed is specified. This continues a search (for example,
+        after adding variables with evaluator_.add_variables) without
+        rescoring the families that were already scored.
+
         For more information about greedy learning algorithms, consult:
 
             1. http://en.wikipedia.org/wiki/Greedy_algorithm
@@ -69,9 +89,11 @@ class GreedyLearner(Learner):
             
         """
 
-        super(GreedyLearner, self).__init__(data_, prior_)
+        super(GreedyLearner, self).__init__(data_, prior_, evaluator_)
         self.options = options
         config.setparams(self, options)
+        if evaluator_ is not None and not self.seed:
+            self.seed = evaluator_.network.copy()
         if not isinstance(self.seed, network.Network):
             self.seed = network.Network(self.data.variables, self.seed)
         
@@ -91,16 +113,19 @@ class GreedyLearner(Learner):
             
         self.stats = GreedyLearnerStatistics()
         self.result = result.LearnerResult(self)
-        self.evaluator = evaluator.fromconfig(self.data, self.seed, self.prior)
-        self.evaluator.score_network(self.seed.copy())
+        self._create_evaluator(self.seed)
+
+        if self.search == 'steepest':
+            _run = self._run_steepest_without_restarts
+        else:
+            _run = self._run_without_restarts
 
         first = True
         self.result.start_run()
         while not _stop():
-            self._run_without_restarts(_stop, self._restart, 
-                                       randomize_net=(not first))
+            _run(_stop, self._restart, randomize_net=(not first))
             first = False
-        self.result.stop_run()
+        self.result.stop_run(self.evaluator.stats)
 
         return self.result
 
@@ -119,9 +144,15 @@ class GreedyLearner(Learner):
             self.stats.iterations += 1
 
             try:
-                curscore = self._alter_network_randomly_and_score()
+                curscore = self._alter_network_randomly_and_score(
+                    minscore=self.stats.best_score)
             except CannotAlterNetworkException:
                 return
+
+            if curscore is None:
+                # move screened out by the evaluator; network unchanged
+                self.stats.unimproved_iterations += 1
+                continue
             
             self.result.add_network(self.evaluator.network, curscore)
 
@@ -133,6 +164,30 @@ class GreedyLearner(Learner):
                 self.stats.best_score = curscore
                 self.stats.unimproved_iterations = 0
 
+    def _run_steepest_without_restarts(self, _stop, _restart, randomize_net=True):
+        self.stats.restarts += 1
+        self.stats.unimproved_iterations = 0
+
+        if randomize_net:
+            self.evaluator.randomize_network()
+
+        self.stats.best_score = self.evaluator.score_network()
+        table = evaluator.NeighborhoodTable(self.evaluator)
+
+        # continue learning until time to stop or restart
+        while not (_restart() or _stop()):
+            self.stats.iterations += 1
+
+            move = table.best_move()
+            if move is None or not move[0] > 0:
+                # local maximum reached
+                return
+
+            delta,add,remove = move
+            self.stats.best_score = self.evaluator.apply_move(add, remove)
+            table.update(add, remove)
+            self.result.add_network(self.evaluator.network, self.stats.best_score)
+
     #
     # Stopping and restarting criteria
     # 
@@ -1,6 +1,6 @@
 """Classes and functions for Simulated Annealing learner"""
 
-from math import exp
+from math import exp, log
 import random
 
 from pebl import network, result, evaluator, config
@@ -57,7 +57,7 @@ class SimulatedAnnealingLearner(Learner):
         )
     )
 
-    def __init__(self, data_=None, prior_=None, **options):
+    def __init__(self, data_=None, prior_=None, evaluator_=None, **options):
         """Create a Simulated Aneaaling learner.
 
         For more information about Simulated Annealing algorithms, consult:
@@ -68,11 +68,17 @@ class SimulatedAnnealingLearner(Learner):
 
         Any config param for 'simanneal' can be passed in via options.
         Use just the option part of the parameter name.
+
+        If evaluator_ is specified, the learner scores networks with it and
+        starts from its network unless a seed is specified (see
+        GreedyLearner).
         
         """
 
-        super(SimulatedAnnealingLearner,self).__init__(data_, prior_)
+        super(SimulatedAnnealingLearner,self).__init__(data_, prior_, evaluator_)
         config.setparams(self, options)
+        if evaluator_ is not None and not self.seed:
+            self.seed = evaluator_.network.copy()
         if not isinstance(self.seed, network.Network):
             self.seed = network.Network(self.data.variables, self.seed)
         
@@ -82,8 +88,7 @@ class SimulatedAnnealingLearner(Learner):
         self.stats = SALearnerStatistics(self.start_temp, self.delta_temp, 
                                          self.max_iters_at_temp)
         self.result =  result.LearnerResult(self)
-        self.evaluator = evaluator.fromconfig(self.data, self.seed, self.prior)
-        self.evaluator.score_network(self.seed.copy())
+        self._create_evaluator(self.seed)
 
         self.result.start_run()
         curscore = self.evaluator.score_network()
@@ -91,14 +96,25 @@ class SimulatedAnnealingLearner(Learner):
         # temperature decays exponentially, so we'll never get to 0. 
         # So, we continue until temp < 1
         while self.stats.temp >= 1:
+            # the acceptance threshold is drawn first so that moves that
+            # can't reach it needn't be scored with all the data
+            u = random.random()
+            minscore = self.stats.current_score + self.stats.temp*log(u) \
+                       if u > 0 else None
+            
             try:
-                newscore = self._alter_network_randomly_and_score()
+                newscore = self._alter_network_randomly_and_score(minscore)
             except CannotAlterNetworkException:
                 return
 
+            if newscore is None:
+                # move screened out by the evaluator; network unchanged
+                self.stats.update()
+                continue
+
             self.result.add_network(self.evaluator.network, newscore)
 
-            if self._accept(newscore):
+            if self._accept(newscore, u):
                 # set current score
                 self.stats.current_score = newscore
                 if self.stats.current_score > self.stats.best_score:
@@ -110,15 +126,17 @@ class SimulatedAnnealingLearner(Learner):
             # temp not updated EVERY iteration. just whenever criteria met.
             self.stats.update() 
 
-        self.result.stop_run()
+        self.result.stop_run(self.evaluator.stats)
         return self.result
 
-    def _accept(self, newscore):
+    def _accept(self, newscore, u=None):
         oldscore = self.stats.current_score
+        if u is None:
+            u = random.random()
 
         if newscore >= oldscore:
             return True
-        elif random.random() < exp((newscore - oldscore)/self.stats.temp):
+        elif u < exp((newscore - oldscore)/self.stats.temp):
             return True
         else:
             return False
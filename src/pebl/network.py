@@ -39,6 +39,11 @@ class EdgeSet(object):
         """Clear the list of edges."""
         self.__init__(len(self._outgoing)) 
 
+    def add_nodes(self, num_nodes):
+        """Add nodes (without edges) after the existing ones."""
+        self._outgoing.extend([] for i in xrange(num_nodes))
+        self._incoming.extend([] for i in xrange(num_nodes))
+
     def add(self, edge):
         """Add an edge to the list."""
         self.add_many([edge])
@@ -256,6 +261,18 @@ class Network(object):
         return _isacyclic(roots, set())
 
 
+    def add_nodes(self, nodes):
+        """Add unconnected nodes to the network (in-place).
+
+        nodes is a list of pebl.data.Variable instances. They get the node ids
+        after the existing ones, so existing edges are unchanged.
+
+        """
+
+        self.nodes = N.concatenate((self.nodes, nodes))
+        self.nodeids = range(len(self.nodes))
+        self.edges.add_nodes(len(nodes))
+
     # TODO: test
     def copy(self):
         """Returns a copy of this network."""
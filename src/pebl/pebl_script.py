@@ -25,6 +25,11 @@ viewhtml <resultfile> <outputdir>
     <outputdir> is where the html files will be placed.
     It will be created if it does not exist.
 
+stats <resultfile>
+    Prints the times and counts for the phases of network scoring.
+    <resultfile> should be a pickled pebl.result of a run with
+    evaluator.instrument=1.
+
 """ % os.path.basename(sys.argv[0])
 
 def usage(msg, exitcode=-1):
@@ -46,7 +51,7 @@ def main():
     if len(sys.argv) < 2:
         usage("Please specify the action.")
 
-    if sys.argv[1] in ('run', 'runtask', 'viewhtml'):
+    if sys.argv[1] in ('run', 'runtask', 'viewhtml', 'stats'):
         action = eval(sys.argv[1])
         action()
     else:
@@ -72,6 +77,9 @@ def run(configfile=None):
     else:
         merged_result.tofile()
 
+    if merged_result.evaluator_stats:
+        print merged_result.evaluator_stats.report()
+
 def runtask(picklefile=None):
     try:
         picklefile = picklefile or sys.argv[2]
@@ -97,6 +105,19 @@ def viewhtml(resultfile=None, outdir=None):
 
     cPickle.load(open(resultfile)).tohtml(outdir)
 
+def stats(resultfile=None):
+    try:
+        resultfile = resultfile or sys.argv[2]
+    except:
+        usage("Please specify the result file.")
+
+    evaluator_stats = cPickle.load(open(resultfile)).evaluator_stats
+    if evaluator_stats:
+        print evaluator_stats.report()
+    else:
+        print "The result does not include evaluator statistics."
+        print "Set evaluator.instrument=1 to collect them."
+
 # -----------------------------
 if __name__ == '__main__':
     main()
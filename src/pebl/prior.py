@@ -1,8 +1,44 @@
 """Classes and functions for representing prior distributions and constraints."""
 
+from __future__ import with_statement
+from collections import defaultdict
+
 import numpy as N
 
+from pebl.util import unzip
+from pebl import config, data
+
+#
+# Module parameters
+#
+_pfilename = config.StringParameter(
+    'prior.filename',
+    """File to read prior (edge energies and constraints) from. See 
+    prior.fromfile for the file format. If not specified, no prior is used.""",
+    default=''
+)
+
+_pdefaultenergy = config.FloatParameter(
+    'prior.default_energy',
+    'Energy of edges not listed in the prior file.',
+    default=0.5
+)
+
+_pweight = config.FloatParameter(
+    'prior.weight',
+    'Weight of the prior read from the prior file.',
+    default=1.0
+)
+
+#
+# Exceptions
+#
+class ParsingError(Exception): 
+    """Error encountered while parsing a prior file."""
+    pass
+
 NEGINF = -N.inf
+POSINF = N.inf
 
 #
 # Prior Models
@@ -22,6 +58,16 @@ class Prior(object):
         * prohibited_edges: a list of edge-tuples that must not be present
         * constraints: a list of functions that take adjacency matrix as input
                        and return true if constraint met and false otherwise.
+        * edge_constraints: a list of functions that take an edge (src, dest)
+                            and return true if the edge is allowed and false
+                            otherwise.
+        * max_indegree, max_outdegree: the maximum number of parents and
+                                       children of any node.
+
+    Constraints on the adjacency matrix are evaluated against the whole network
+    and are O(n**2). Edge constraints and degree limits only depend on the
+    edges being changed, so they should be preferred when possible; they can
+    be checked for a single move with allows and allows_move.
 
    For more information about calculating prior probabilities via energy
    matrices, consult: 
@@ -35,7 +81,8 @@ class Prior(object):
     """
 
     def __init__(self, num_nodes, energy_matrix=None, required_edges=[], 
-                 prohibited_edges=[], constraints=[], weight=1.0):
+                 prohibited_edges=[], constraints=[], weight=1.0, 
+                 edge_constraints=[], max_indegree=None, max_outdegree=None):
         
         self.energy_matrix = energy_matrix
         
@@ -56,6 +103,9 @@ class Prior(object):
             self.mustnotexist[src,dest] = 1
 
         self.constraints = constraints
+        self.edge_constraints = edge_constraints
+        self.max_indegree = max_indegree
+        self.max_outdegree = max_outdegree
         self.weight = weight
 
     # TODO: test
@@ -76,20 +126,155 @@ class Prior(object):
         
         """
 
+        return self._loglikelihood(net.edges.adjacency_matrix)
+
+    def loglikelihood_after(self, net, add=[], remove=[]):
+        """Returns the log likelihood of net after adding and removing edges.
+
+        The changes are not applied to net. As with
+        SmartNetworkEvaluator.alter_network, edges are removed before new ones
+        are added.
+
+        """
+
         adjmat = net.edges.adjacency_matrix
+        if remove:
+            adjmat[unzip(remove)] = False
+        if add:
+            adjmat[unzip(add)] = True
+        return self._loglikelihood(adjmat)
+
+    def edge_loglikelihood(self, src, dest):
+        """Returns the change in log likelihood from adding edge src->dest.
+
+        Only the parts of the prior that depend on this one edge (its energy
+        and whether it is required or prohibited) are considered. Prohibited
+        edges return -inf and required edges return inf. Removing the edge
+        changes the log likelihood by the negated value.
+
+        Custom constraints are not considered because they depend on the whole
+        network.
+
+        """
+
+        violations = self._edge_violations(src, dest)
+        if violations > 0:
+            return NEGINF
+        if violations < 0:
+            return POSINF
+        return -self.weight * self._edge_energy(src, dest)
+
+    def allows(self, src, dest):
+        """Returns whether the edge src->dest may exist in any network.
+
+        Self-loops, prohibited edges and edges rejected by any of the edge
+        constraints are not allowed.
+
+        """
+
+        return src != dest and not self.mustnotexist[src,dest] and \
+               all(c(src, dest) for c in self.edge_constraints)
+
+    def allows_move(self, net, add=[], remove=[]):
+        """Returns whether the edge-local constraints allow the given move.
+
+        All edges in add must be allowed (see allows) and, after the move, no
+        node may have more parents or children than max_indegree and
+        max_outdegree. Edges in add should not already exist in net and edges
+        in remove should. Only the changed edges are examined. Required edges
+        and custom constraints are not checked.
+
+        """
+
+        if not all(self.allows(src, dest) for src,dest in add):
+            return False
+
+        if self.max_indegree is not None:
+            for node,change in _degree_changes(add, remove, 1).iteritems():
+                if change > 0 and len(net.edges.parents(node)) + change > \
+                                  self.max_indegree:
+                    return False
+
+        if self.max_outdegree is not None:
+            for node,change in _degree_changes(add, remove, 0).iteritems():
+                if change > 0 and len(net.edges.children(node)) + change > \
+                                  self.max_outdegree:
+                    return False
+
+        return True
+
+    def precedes(self, src, dest):
+        """Returns whether src comes before dest in an ordering of the nodes.
 
+        If so, every network whose edges are all allowed by this prior has no
+        path from dest to src, so adding the edge src->dest to such a network
+        cannot create a cycle. Priors without an ordering (like this one)
+        always return False. See OrderingPrior.
+
+        """
+
+        return False
+
+    def state(self, net):
+        """Returns a PriorState for incrementally scoring changes to net."""
+        return PriorState(self, net)
+
+    #
+    # Private methods
+    #
+    def _edge_energy(self, src, dest):
+        # energy of edge src->dest
+        if self.energy_matrix is None:
+            return 0.0
+        return self.energy_matrix[src,dest]
+
+    def _edge_violations(self, src, dest):
+        # change in the number of violated required/disallowed edges when
+        # edge src->dest is added
+        return int(not self.allows(src, dest)) - \
+               int(not self.mustexist[src,dest])
+
+    def _network_terms(self, net):
+        # total energy and number of violated required/disallowed edges
+        adjmat = net.edges.adjacency_matrix
+        violations = int((~(adjmat | self.mustexist)).sum()) + \
+                     int((adjmat & self.mustnotexist).sum())
+        if self.edge_constraints:
+            violations += sum(1 for src,dest in zip(*N.nonzero(adjmat)) 
+                              if not self.mustnotexist[src,dest] and \
+                                 not self.allows(src, dest))
+
+        energy = 0.0
+        if self.energy_matrix is not None:
+            energy = N.sum(adjmat * self.energy_matrix)
+
+        return energy, violations
+
+    def _loglikelihood(self, adjmat):
         # if any of the mustexist or mustnotexist constraints are violated,
         # return negative infinity
         if (not (adjmat | self.mustexist).all()) or \
            (adjmat & self.mustnotexist).any():
             return NEGINF
 
+        # if any edge constraints or degree limits are violated, return
+        # negative infinity
+        if self.edge_constraints and \
+           not all(self.allows(s,d) for s,d in zip(*N.nonzero(adjmat))):
+            return NEGINF
+        if self.max_indegree is not None and \
+           (adjmat.sum(axis=0) > self.max_indegree).any():
+            return NEGINF
+        if self.max_outdegree is not None and \
+           (adjmat.sum(axis=1) > self.max_outdegree).any():
+            return NEGINF
+
         # if any custom constraints are violated, return negative infinity
         if self.constraints and not all(c(adjmat) for c in self.constraints):
             return NEGINF
 
         loglike = 0.0
-        if self.energy_matrix != None:
+        if self.energy_matrix is not None:
             energy = N.sum(adjmat * self.energy_matrix) 
             loglike = -self.weight * energy
 
@@ -115,12 +300,337 @@ class NullPrior(Prior):
 
     """
 
+    constraints = []
+    edge_constraints = []
+    max_indegree = None
+    max_outdegree = None
+    weight = 1.0
+
     def __init__(self, *args, **kwargs):
         pass
 
     def loglikelihood(self, net):
         return 0.0
 
-def fromconfig():
-    # TODO: implement this
-    return NullPrior()
+    def loglikelihood_after(self, net, add=[], remove=[]):
+        return 0.0
+
+    def edge_loglikelihood(self, src, dest):
+        return 0.0
+
+    def allows(self, src, dest):
+        return True
+
+    def allows_move(self, net, add=[], remove=[]):
+        return True
+
+    def _edge_energy(self, src, dest):
+        return 0.0
+
+    def _edge_violations(self, src, dest):
+        return 0
+
+    def _network_terms(self, net):
+        return 0.0, 0
+
+
+class SparsePrior(Prior):
+    """A prior with energies for only some of the edges.
+
+    Prior stores energies and required/prohibited edges in dense n*n matrices,
+    which is prohibitive for networks with thousands of nodes. SparsePrior
+    stores energies in a dict keyed by edge and required and prohibited edges
+    in sets. Edges not in energies have default_energy. The log likelihood of
+    a network is calculated from its edges, without creating an adjacency
+    matrix (unless there are custom constraints). With the default energy of
+    0.5 and no energies, this is equivalent to UniformPrior.
+
+    See Prior for the other arguments.
+
+    """
+
+    def __init__(self, num_nodes, energies={}, default_energy=0.5,
+                 required_edges=[], prohibited_edges=[], constraints=[], 
+                 weight=1.0, edge_constraints=[], max_indegree=None, 
+                 max_outdegree=None):
+
+        self.num_nodes = num_nodes
+        self.energies = dict(((s,d), float(e)) for (s,d),e in energies.iteritems())
+        self.default_energy = default_energy
+        self.energy_matrix = None
+
+        self.required = set((s,d) for s,d in required_edges)
+        self.prohibited = set((s,d) for s,d in prohibited_edges)
+
+        self.constraints = constraints
+        self.edge_constraints = edge_constraints
+        self.max_indegree = max_indegree
+        self.max_outdegree = max_outdegree
+        self.weight = weight
+
+    @property
+    def required_edges(self):
+        return sorted(list(e) for e in self.required)
+
+    @property
+    def prohibited_edges(self):
+        return sorted(list(e) for e in self.prohibited)
+
+    def loglikelihood(self, net):
+        return self.state(net).loglikelihood()
+
+    def loglikelihood_after(self, net, add=[], remove=[]):
+        net = net.copy()
+        net.edges.remove_many(remove)
+        net.edges.add_many(add)
+        return self.loglikelihood(net)
+
+    def allows(self, src, dest):
+        return src != dest and (src, dest) not in self.prohibited and \
+               all(c(src, dest) for c in self.edge_constraints)
+
+    #
+    # Private methods
+    #
+    def _edge_energy(self, src, dest):
+        return self.energies.get((src, dest), self.default_energy)
+
+    def _edge_violations(self, src, dest):
+        return int(not self.allows(src, dest)) - \
+               int((src, dest) in self.required)
+
+    def _network_terms(self, net):
+        edges = net.edges
+        energy = 0.0
+        violations = sum(1 for edge in self.required if edge not in edges)
+        for src,dest in edges:
+            energy += self._edge_energy(src, dest)
+            violations += int(not self.allows(src, dest))
+        return energy, violations
+
+
+class OrderingPrior(SparsePrior):
+    """A prior that orders the nodes into tiers.
+
+    tiers is a list with the tier of each node (any sortable values, such as
+    ints). Edges may only go from a node to nodes in later tiers (or, unless
+    strict is True, to nodes in the same tier). Giving each node its own tier
+    specifies a total ordering. For example, with tiers for genotype,
+    expression and phenotype variables, genotypes can only be parents of
+    expression and phenotype variables.
+
+    Any network that only has edges allowed by a strict ordering is acyclic,
+    so SmartNetworkEvaluator does not check such networks for cycles (see
+    precedes). With a non-strict ordering, only edges within a tier need to
+    be checked.
+
+    See SparsePrior and Prior for the other arguments.
+
+    """
+
+    def __init__(self, tiers, strict=True, energies={}, default_energy=0.5,
+                 required_edges=[], prohibited_edges=[], constraints=[], 
+                 weight=1.0, edge_constraints=[], max_indegree=None, 
+                 max_outdegree=None):
+
+        super(OrderingPrior, self).__init__(
+            len(tiers), energies, default_energy, required_edges, 
+            prohibited_edges, constraints, weight, edge_constraints, 
+            max_indegree, max_outdegree
+        )
+
+        self.tiers = list(tiers)
+        self.strict = strict
+
+    def allows(self, src, dest):
+        tiers = self.tiers
+        if tiers[src] > tiers[dest] or (self.strict and tiers[src] == tiers[dest]):
+            return False
+        return super(OrderingPrior, self).allows(src, dest)
+
+    def precedes(self, src, dest):
+        return self.tiers[src] < self.tiers[dest]
+
+
+class PriorState(object):
+    """The log likelihood of a prior for a network that changes edge by edge.
+
+    Rebuilding the adjacency matrix to score every small change to a network
+    is O(n**2). Instead, a PriorState keeps the total energy of the network's
+    edges, the number of violated required and disallowed edges and the
+    number of nodes with too many parents or children, and updates them as
+    edges are added and removed. Scoring a change then costs O(1) per changed
+    edge. Custom constraints depend on the whole network, so they are still
+    checked using the adjacency matrix.
+
+    Changes must be reported with update after they are applied to the
+    network. Edges in add should not already exist in the network and edges
+    in remove should (SmartNetworkEvaluator ensures this).
+
+    """
+
+    def __init__(self, prior_, net):
+        self.prior = prior_
+        self.net = net
+        self.energy, self.violations = prior_._network_terms(net)
+
+        # nodes with too many parents or children count as violations
+        self.degrees = []
+        nodes = xrange(len(net.nodes))
+        for index,edges,maxdegree in ((1, net.edges.parents, prior_.max_indegree), 
+                                      (0, net.edges.children, prior_.max_outdegree)):
+            if maxdegree is None:
+                continue
+            degrees = N.array([len(edges(n)) for n in nodes])
+            self.violations += int((degrees > maxdegree).sum())
+            self.degrees.append((index, degrees, maxdegree))
+
+    def loglikelihood(self):
+        """Returns the log likelihood of the network."""
+        return self._loglikelihood(self.energy, self.violations)
+
+    def loglikelihood_after(self, add=[], remove=[]):
+        """Returns the log likelihood of the network after the given changes."""
+        energy, violations = self._changed_terms(add, remove)
+        return self._loglikelihood(energy, violations, add, remove)
+
+    def update(self, add=[], remove=[]):
+        """Record changes that were made to the network."""
+        self.energy, self.violations = self._changed_terms(add, remove)
+        for index,degrees,maxdegree in self.degrees:
+            for node,change in _degree_changes(add, remove, index).iteritems():
+                degrees[node] += change
+
+    def _changed_terms(self, add, remove):
+        prior_ = self.prior
+        energy, violations = self.energy, self.violations
+
+        for index,degrees,maxdegree in self.degrees:
+            for node,change in _degree_changes(add, remove, index).iteritems():
+                violations += int(degrees[node] + change > maxdegree) - \
+                              int(degrees[node] > maxdegree)
+
+        for src,dest in add:
+            energy += prior_._edge_energy(src, dest)
+            violations += prior_._edge_violations(src, dest)
+        for src,dest in remove:
+            energy -= prior_._edge_energy(src, dest)
+            violations -= prior_._edge_violations(src, dest)
+
+        return energy, violations
+
+    def _loglikelihood(self, energy, violations, add=[], remove=[]):
+        if violations:
+            return NEGINF
+
+        constraints = self.prior.constraints
+        if constraints:
+            adjmat = self.net.edges.adjacency_matrix
+            if remove:
+                adjmat[unzip(remove)] = False
+            if add:
+                adjmat[unzip(add)] = True
+            if not all(c(adjmat) for c in constraints):
+                return NEGINF
+
+        return -self.prior.weight * energy
+
+def _degree_changes(add, remove, index):
+    # change in the number of parents (index=1) or children (index=0) of nodes
+    # due to the given move
+    changes = defaultdict(int)
+    for edge in add:
+        changes[edge[index]] += 1
+    for edge in remove:
+        changes[edge[index]] -= 1
+    return changes
+
+#
+# Factory functions
+#
+def fromfile(filename, data_, default_energy=0.5, weight=1.0):
+    """Parse a prior file and return a SparsePrior.
+
+    Variables are referred to by name, so the dataset that the prior will be
+    used with (data_) is required. The file is expected to conform to the
+    following format:
+
+        - comment lines begin with '#' and are ignored (as are blank lines).
+        - every other line specifies an edge with three tab-separated fields:
+          the source variable, the destination variable and either the energy
+          of the edge (a number), 'required' or 'prohibited'.
+
+    For example::
+
+        # src   dest    energy
+        geneA   geneB   0.1
+        geneB   geneC   required
+        geneC   geneA   prohibited
+
+    Edges not listed in the file have default_energy.
+
+    """
+
+    with file(filename) as f:
+        return fromstring(f.read(), data_, default_energy, weight)
+
+def fromstring(stringrep, data_, default_energy=0.5, weight=1.0, fieldsep='\t'):
+    """Parse the string representation of a prior and return a SparsePrior.
+
+    See the documentation for fromfile() for information about the format.
+
+    """
+
+    varindex = dict((v.name, i) for i,v in enumerate(data_.variables))
+    energies = {}
+    required = []
+    prohibited = []
+
+    for lineno,line in enumerate(stringrep.splitlines()):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        parts = [p.strip() for p in line.split(fieldsep)]
+        if len(parts) != 3:
+            msg = "Line %d: expected 3 fields but found %d." % (lineno+1, len(parts))
+            raise ParsingError(msg)
+
+        try:
+            edge = (varindex[parts[0]], varindex[parts[1]])
+        except KeyError, e:
+            msg = "Line %d: unknown variable %s." % (lineno+1, e.args[0])
+            raise ParsingError(msg)
+        
+        value = parts[2].lower()
+        if value == 'required':
+            required.append(edge)
+        elif value == 'prohibited':
+            prohibited.append(edge)
+        else:
+            try:
+                energies[edge] = float(value)
+            except ValueError:
+                msg = "Line %d: invalid energy %s." % (lineno+1, parts[2])
+                raise ParsingError(msg)
+
+    return SparsePrior(data_.variables.size, energies, default_energy, 
+                       required, prohibited, weight=weight)
+
+def fromconfig(data_=None):
+    """Create a prior from the configuration information.
+
+    Returns a SparsePrior read from prior.filename or, if no file is
+    specified, a NullPrior. The dataset is read from the configuration if not
+    provided.
+
+    """
+
+    filename = config.get('prior.filename')
+    if not filename:
+        return NullPrior()
+
+    return fromfile(filename, 
+                    data_ or data.fromconfig(), 
+                    config.get('prior.default_energy'),
+                    config.get('prior.weight'))
@@ -22,7 +22,7 @@ try:
 except:
     _can_create_html = False
     
-from pebl import posterior, config
+from pebl import posterior, config, evaluator
 from pebl.util import flatten, rescale_logvalues
 from pebl.network import Network
 
@@ -56,6 +56,7 @@ class LearnerRunStats:
         self.start = start
         self.end = None
         self.host = socket.gethostname()
+        self.evaluator_stats = None
 
 class LearnerResult:
     """Class for storing any and all output of a learner.
@@ -105,9 +106,15 @@ class LearnerResult:
         """Indicates that the learner is starting a new run."""
         self.runs.append(LearnerRunStats(time.time()))
 
-    def stop_run(self):
-        """Indicates that the learner is stopping a run."""
+    def stop_run(self, evaluator_stats=None):
+        """Indicates that the learner is stopping a run.
+
+        evaluator_stats are the times and counts collected by an instrumented
+        evaluator during the run (see evaluator.EvaluatorStats).
+
+        """
         self.runs[-1].end = time.time()
+        self.runs[-1].evaluator_stats = evaluator_stats
 
     def add_network(self, net, score):
         """Add a network and score to the results."""
@@ -152,6 +159,22 @@ class LearnerResult:
         else:
             print "Cannot create html reports because some dependencies are missing."
 
+    @property
+    def evaluator_stats(self):
+        """Returns the evaluator times and counts summed over all runs.
+
+        Returns None if none of the runs used an instrumented evaluator.
+
+        """
+        
+        runstats = [getattr(r, 'evaluator_stats', None) for r in self.runs]
+        runstats = [stats for stats in runstats if stats is not None]
+        if not runstats:
+            return None
+        
+        return reduce(lambda total,stats: total.merge(stats), runstats, 
+                      evaluator.EvaluatorStats())
+
     @property
     def posterior(self):
         """Returns a posterior object for this result."""
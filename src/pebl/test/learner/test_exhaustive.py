@@ -0,0 +1,63 @@
+import cPickle
+from numpy import allclose
+
+from pebl.test import testfile
+from pebl import data, config, evaluator, network
+from pebl.learner import exhaustive
+
+class TestListLearner:
+    def setUp(self):
+        self.data = data.fromfile(testfile('greedytest1-200.txt'))
+        netstrings = ["0,1;1,2", "0,1;1,2;3,4", "1,2;3,4", "", "3,4;0,1"]
+        self.networks = [network.Network(self.data.variables, s) 
+                         for s in netstrings]
+
+    def _scores(self, networks):
+        ne = evaluator.SmartNetworkEvaluator(self.data, 
+                                             network.fromdata(self.data))
+        return [ne.score_network(net.copy()) for net in networks]
+
+    def test_run(self):
+        config.set('listlearner.batch_size', 2)
+        try:
+            learner = exhaustive.ListLearner(self.data, networks=self.networks)
+            result = learner.run()
+        finally:
+            config.set('listlearner.batch_size', 1000)
+
+        assert len(result.networks) == 5
+        expected = sorted(self._scores(self.networks))
+        assert allclose(sorted(n.score for n in result.networks), expected)
+
+    def test_split(self):
+        learner = exhaustive.ListLearner(self.data, networks=self.networks)
+        learners = learner.split(2)
+        assert [len(l.networks) for l in learners] == [2, 3]
+        assert [n.as_string() for l in learners for n in l.networks] == \
+               [n.as_string() for n in self.networks]
+
+        # more learners than networks
+        assert len(learner.split(10)) == 5
+
+    def test_split_by_families(self):
+        config.set('listlearner.order', 'families')
+        try:
+            learner = exhaustive.ListLearner(self.data, networks=self.networks)
+            learners = learner.split(2)
+        finally:
+            config.set('listlearner.order', 'given')
+        
+        # the networks with edge 0->1 (and so, family (1,0)) are scored by the
+        # same learner 
+        assert [sorted(n.as_string() for n in l.networks) for l in learners] == \
+               [["", "1,2;3,4"], ["0,1;1,2", "0,1;1,2;3,4", "0,1;3,4"]]
+
+    def test_pickle(self):
+        learner = exhaustive.ListLearner(self.data, 
+                                         networks=iter(self.networks))
+        learner2 = cPickle.loads(cPickle.dumps(learner))
+        assert [n.as_string() for n in learner2.networks] == \
+               [n.as_string() for n in self.networks]
+        assert learner2.networks[0].nodes is learner2.data.variables
+        assert allclose(sorted(n.score for n in learner2.run().networks),
+                        sorted(self._scores(self.networks)))
@@ -1,5 +1,5 @@
 from pebl.test import testfile
-from pebl import data, result
+from pebl import data, result, prior, config, evaluator, network
 from pebl.learner import greedy
 
 class TestGreedyLearner:
@@ -12,6 +12,27 @@ class TestGreedyLearner:
         g.run()
         assert g.stats.iterations == 100
 
+    def test_steepest_ascent(self):
+        g = greedy.GreedyLearner(self.data, max_iterations=100, search='steepest')
+        g.run()
+        assert g.stats.iterations == 100
+
+    def test_edge_constraints(self):
+        p = prior.Prior(self.data.variables.size, max_indegree=1,
+                        edge_constraints=[lambda src,dest: src < dest])
+        g = greedy.GreedyLearner(self.data, p, max_iterations=100)
+        g.run()
+        net = g.result.posterior[0]
+        assert all(src < dest for src,dest in net.edges)
+        assert all(len(net.edges.parents(n)) <= 1 for n in xrange(len(net.nodes)))
+
+    def test_ordering_prior(self):
+        p = prior.OrderingPrior(range(self.data.variables.size))
+        g = greedy.GreedyLearner(self.data, p, max_iterations=100)
+        g.run()
+        net = g.result.posterior[0]
+        assert all(src < dest for src,dest in net.edges)
+
     def test_max_time(self):
         g = greedy.GreedyLearner(self.data, max_time=2)
         g.run()
@@ -29,5 +50,27 @@ class TestGreedyLearner:
 
         assert g1.stats.restarts > g2.stats.restarts
 
+    def test_racing(self):
+        data_ = data.fromfile(testfile('greedytest1-200.txt'))
+        config.set('evaluator.racing_subsample', 20)
+        try:
+            g = greedy.GreedyLearner(data_, max_iterations=100)
+            g.run()
+        finally:
+            config.set('evaluator.racing_subsample', 0)
+        assert g.stats.iterations == 100
+        assert g.raced > 0
 
+    def test_continue_with_evaluator(self):
+        data_ = data.fromfile(testfile('greedytest1-200.txt'))
+        ne = evaluator.SmartNetworkEvaluator(data_.subset(range(3)),
+                                             network.Network(data_.variables[:3], "0,2"))
+        ne.score_network()
+        ne.add_variables(data_.observations[:,3:])
 
+        misses = ne.localscore_cache.misses
+        g = greedy.GreedyLearner(evaluator_=ne, max_iterations=20)
+        g.run()
+        assert g.evaluator is ne and g.data is ne.data
+        assert len(g.seed.nodes) == 5 and (0,2) in g.seed.edges
+        assert g.stats.iterations == 20
@@ -142,6 +142,19 @@ class TestCPD_Py:
         self.cpd.replace_data(array([0,1,1,0]), array([1,1,1,0]))
         assert allclose(self.cpd.loglikelihood(), -2.77258872224)
 
+    def test_add_data(self):
+        newrows = array([[1, 1, 1, 0],
+                         [0, 0, 0, 0]])
+        self.cpd.add_data(newrows)
+        self.data.append(newrows)
+        assert allclose(self.cpd.loglikelihood(), 
+                        self.cpdtype(self.data).loglikelihood())
+
+    def test_remove_data(self):
+        self.cpd.remove_data(self.data.observations[:2])
+        assert allclose(self.cpd.loglikelihood(), 
+                        self.cpdtype(self.data.subset(samples=[2,3,4])).loglikelihood())
+
 
 class TestCPD_C(TestCPD_Py):
     cpdtype = cpd.MultinomialCPD_C
@@ -338,3 +338,104 @@ def test_arity_checking2():
     
     assert [v.arity for v in dataset.variables] == [3,4,3,6]
 
+
+class TestColumnLayout:
+    def setUp(self):
+        self.rows = data.fromfile(testfile('testdata5.txt'))
+        self.columns = data.fromfile(testfile('testdata5.txt'), layout='columns')
+
+    def test_layout(self):
+        assert self.rows.layout == 'rows'
+        assert self.columns.layout == 'columns'
+        assert self.columns.observations.flags.f_contiguous
+        assert self.columns.interventions.flags.f_contiguous
+        assert (self.rows.observations == self.columns.observations).all()
+
+    def test_subset(self):
+        assert self.columns.subset([2,0]).layout == 'columns'
+        assert (self.columns.subset([2,0]).observations == \
+                self.rows.subset([2,0]).observations).all()
+
+    def test_subset_ni_fast(self):
+        self.rows.interventions[0,1] = self.columns.interventions[0,1] = True
+        self.rows._calc_stats()
+        self.columns._calc_stats()
+        
+        for variables in ([1], [1,0,2], [0,1]):
+            assert (self.columns._subset_ni_fast(variables).observations == 
+                    self.rows._subset_ni_fast(variables).observations).all()
+
+    def test_set_layout(self):
+        self.columns.set_layout('rows')
+        assert self.columns.layout == 'rows'
+        try:
+            self.columns.set_layout('diagonal')
+        except ValueError:
+            assert True
+        else:
+            assert False
+
+class TestAppend:
+    def setUp(self):
+        self.data = data.fromfile(testfile('testdata5.txt'))
+        self.newrows = self.data.observations[:3].copy()
+
+    def test_append(self):
+        numsamples = self.data.samples.size
+        new = self.data.append(self.newrows)
+        assert self.data.shape == (numsamples + 3, self.data.variables.size)
+        assert (self.data.observations[-3:] == self.newrows).all()
+        assert (new.observations == self.newrows).all()
+        assert self.data.samples[-1].name == str(numsamples + 2)
+        assert new.variables is self.data.variables
+
+    def test_interventions(self):
+        interventions = N.zeros(self.newrows.shape, dtype=bool)
+        interventions[1,2] = True
+        self.data.append(self.newrows, interventions=interventions)
+        assert self.data.has_interventions
+        assert not self.data.has_missing
+        assert self.data.interventions[-2,2]
+
+    def test_layout(self):
+        self.data.set_layout('columns')
+        self.data.append(self.newrows)
+        assert self.data.layout == 'columns'
+
+    def test_replace_samples(self):
+        observations = self.data.observations
+        oldrows = observations[[4,0]].copy()
+        new, old = self.data.replace_samples([4,0], self.newrows[:2])
+        assert self.data.observations is observations
+        assert (self.data.observations[[4,0]] == self.newrows[:2]).all()
+        assert (old.observations == oldrows).all()
+        assert (new.observations == self.newrows[:2]).all()
+
+    def test_replace_interventions(self):
+        interventions = N.zeros(self.newrows.shape, dtype=bool)
+        interventions[1,2] = True
+        self.data.replace_samples([0,1,2], self.newrows, 
+                                  interventions=interventions)
+        assert self.data.has_interventions
+        self.data.replace_samples([1], self.newrows[:1])
+        assert not self.data.has_interventions
+
+class TestAddVariables:
+    def setUp(self):
+        self.data = data.fromfile(testfile('testdata5.txt'))
+        self.data.discretize()
+        self.newcols = self.data.observations[:,:2].copy()
+
+    def test_add_variables(self):
+        numvars = self.data.variables.size
+        new = self.data.add_variables(self.newcols)
+        assert self.data.shape == (self.data.samples.size, numvars + 2)
+        assert (self.data.observations[:,-2:] == self.newcols).all()
+        assert self.data.variables[-1].name == str(numvars + 1)
+        assert self.data.variables[-1].arity == new.variables[-1].arity
+        assert new.samples is self.data.samples
+
+    def test_layout(self):
+        self.data.set_layout('columns')
+        self.data.add_variables(self.newcols)
+        assert self.data.layout == 'columns'
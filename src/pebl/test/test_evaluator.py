@@ -161,6 +161,215 @@ class TestSmartNetworkEvaluator:
         assert allclose(self.ne.restore_network(), -15.0556224089)
         assert list(self.ne.network.edges) == [(1, 0), (2, 0), (2, 3), (3, 0)]
 
+    def test_restore_multiple(self):
+        self.ne.alter_network(add=[(1,0),(2,0),(3,0)])
+        self.ne.alter_network(add=[(2,3)])
+        self.ne.alter_network(add=[(1,2)], remove=[(1,0)])
+        assert allclose(self.ne.restore_network(), -15.0556224089)
+        assert allclose(self.ne.restore_network(), -15.461087517)
+        assert list(self.ne.network.edges) == [(1, 0), (2, 0), (3, 0)]
+        assert allclose(self.ne.alter_network(add=[(1,2)]), -15.2379439657)
+
+    def test_restore_to_start(self):
+        self.ne.alter_network(add=[(1,0),(2,0),(3,0)])
+        self.ne.alter_network(add=[(2,3)])
+        self.ne.restore_network()
+        self.ne.restore_network()
+        assert list(self.ne.network.edges) == []
+        assert self.ne.restore_network() is None
+        assert allclose(self.ne.score_network(), -15.6842310683)
+
+    def test_undo_depth(self):
+        self.ne.undo_depth = 2
+        for edge in [(1,0), (2,0), (3,0)]:
+            self.ne.alter_network(add=[edge])
+        for i in xrange(3):
+            self.ne.restore_network()
+        assert list(self.ne.network.edges) == [(1, 0)]
+
+    def test_localscore_sum(self):
+        self.ne.alter_network(add=[(1,0),(2,0),(3,0)])
+        self.ne.alter_network(add=[(2,3)])
+        self.ne.alter_network(add=[(1,2)], remove=[(1,0)])
+        self.ne.restore_network()
+        assert allclose(self.ne.localscore_sum, sum(self.ne.localscores))
+
+    def test_score_move1(self):
+        self.ne.alter_network(add=[(1,0),(2,0),(3,0)])
+        assert allclose(self.ne.score_move(add=[(1,2)]), -15.2379439657 - -15.461087517)
+        assert list(self.ne.network.edges) == [(1, 0), (2, 0), (3, 0)]
+        assert allclose(self.ne.score, -15.461087517)
+
+    def test_score_move2(self):
+        self.ne.alter_network(add=[(1,0),(2,0),(3,0)])
+        self.ne.alter_network(add=[(2,3)])
+        assert allclose(
+            self.ne.score_move(add=[(1,2), (1,3)], remove=[(1,0), (3,0)]),
+            -14.139331677 - -15.0556224089
+        )
+        assert list(self.ne.network.edges) == [(1, 0), (2, 0), (2, 3), (3, 0)]
+
+    def test_apply_move(self):
+        self.ne.alter_network(add=[(1,0),(2,0),(3,0)])
+        self.ne.score_move(add=[(2,3)])
+        assert allclose(self.ne.apply_move(add=[(2,3)]), -15.0556224089)
+        assert allclose(self.ne.restore_network(), -15.461087517)
+        assert list(self.ne.network.edges) == [(1, 0), (2, 0), (3, 0)]
+
+class TestSmartNetworkEvalWithPrior:
+    def setUp(self):
+        self.data = data.fromfile(testfile('testdata10.txt'))
+        self.ne = evaluator.SmartNetworkEvaluator(
+            self.data,
+            network.fromdata(self.data),
+            prior.Prior(self.data.variables.size, prohibited_edges=[(0,3)]))
+        self.ne.alter_network(add=[(1,0),(2,0),(3,0)])
+
+    def test_score_move(self):
+        delta = self.ne.score_move(add=[(2,3)])
+        assert allclose(self.ne.score + delta, self.ne.alter_network(add=[(2,3)]))
+
+    def test_score_move_prohibited(self):
+        assert self.ne.score_move(remove=[(3,0)], add=[(0,3)]) == float('-inf')
+
+    def test_prior_tracking(self):
+        self.ne.alter_network(add=[(2,3)])
+        self.ne.alter_network(add=[(1,3)], remove=[(1,0)])
+        self.ne.restore_network()
+        self.ne.alter_network(add=[(1,2), (1,2)], remove=[(2,1)])
+        assert self.ne.priorstate.loglikelihood() == \
+               self.ne.prior.loglikelihood(self.ne.network)
+        assert allclose(
+            self.ne.score, 
+            evaluator.NetworkEvaluator(self.data, self.ne.network.copy(), 
+                                       self.ne.prior).score_network()
+        )
+
+    def test_prohibited(self):
+        self.ne.alter_network(remove=[(3,0)], add=[(0,3)])
+        assert self.ne.score == float('-inf')
+        assert allclose(self.ne.restore_network(), -15.461087517)
+
+class TestSmartNetworkEvalWithEdgeConstraints:
+    def setUp(self):
+        self.data = data.fromfile(testfile('testdata10.txt'))
+        self.ne = evaluator.SmartNetworkEvaluator(
+            self.data,
+            network.fromdata(self.data),
+            prior.Prior(self.data.variables.size, max_indegree=2,
+                        edge_constraints=[lambda src,dest: dest != 3]))
+        self.ne.alter_network(add=[(1,0),(2,0)])
+
+    def test_score_move(self):
+        assert self.ne.score_move(add=[(3,1)]) > float('-inf')
+        assert self.ne.score_move(add=[(1,3)]) == float('-inf')
+
+    def test_score_move_indegree(self):
+        assert self.ne.score_move(add=[(3,0)]) == float('-inf')
+        assert self.ne.score_move(add=[(3,0)], remove=[(1,0)]) > float('-inf')
+
+    def test_best_move(self):
+        self.ne.prior.max_indegree = 1
+        self.ne.alter_network(remove=[(2,0)])
+        delta,add,remove = evaluator.NeighborhoodTable(self.ne).best_move()
+        assert self.ne.prior.allows_move(self.ne.network, add, remove)
+
+class TestSmartNetworkEvalWithOrderingPrior:
+    def setUp(self):
+        self.data = data.fromfile(testfile('testdata10.txt'))
+        self.ne = evaluator.SmartNetworkEvaluator(
+            self.data,
+            network.fromdata(self.data),
+            prior.OrderingPrior([0, 1, 1, 2], strict=False))
+        self.ne.alter_network(add=[(0,1),(1,3)])
+        self.checked = []
+        is_acyclic = self.ne.network.is_acyclic
+        def check(roots=None):
+            self.checked.append(set(roots))
+            return is_acyclic(roots)
+        self.ne.network.is_acyclic = check
+
+    def test_ordered_edges(self):
+        self.ne.alter_network(add=[(0,3),(2,3)])
+        assert self.checked == []
+
+    def test_unordered_edges(self):
+        self.ne.alter_network(add=[(0,2),(1,2)])
+        assert self.checked == [set([2])]
+
+    def test_cycle(self):
+        self.ne.alter_network(add=[(1,2)])
+        try:
+            self.ne.alter_network(add=[(2,1)])
+        except evaluator.CyclicNetworkError:
+            pass
+        else:
+            assert False, "CyclicNetworkError not raised"
+
+    def test_disallowed_edges(self):
+        # once the network has a disallowed edge, all changes are checked
+        self.ne.alter_network(add=[(2,0)])
+        assert self.ne.score == float('-inf')
+        try:
+            self.ne.alter_network(add=[(0,2)])
+        except evaluator.CyclicNetworkError:
+            pass
+        else:
+            assert False, "CyclicNetworkError not raised"
+
+class TestNeighborhoodTable:
+    def setUp(self):
+        self.data = data.fromfile(testfile('testdata10.txt'))
+        self.ne = evaluator.SmartNetworkEvaluator(
+            self.data,
+            network.fromdata(self.data),
+            prior.UniformPrior(self.data.variables.size))
+        self.ne.alter_network(add=[(1,0),(2,0),(3,0)])
+        self.table = evaluator.NeighborhoodTable(self.ne)
+
+    def test_add_delta(self):
+        assert allclose(self.table.deltas[1,2], self.ne.score_move(add=[(1,2)]))
+
+    def test_remove_delta(self):
+        assert allclose(self.table.deltas[1,0], self.ne.score_move(remove=[(1,0)]))
+
+    def test_moves_scored(self):
+        for delta,add,remove in self.table.moves():
+            assert allclose(delta, self.ne.score_move(add, remove))
+
+    def test_update(self):
+        self.ne.apply_move(add=[(2,3)])
+        self.table.update(add=[(2,3)])
+        assert allclose(self.table.deltas, evaluator.NeighborhoodTable(self.ne).deltas)
+
+    def test_best_move(self):
+        delta,add,remove = self.table.best_move()
+        better = [(a,r) for d,a,r in self.table.moves() if d > delta]
+        assert all(self.table._creates_cycle(a, r) for a,r in better)
+        self.ne.apply_move(add, remove)
+        assert self.ne.network.is_acyclic()
+
+    def test_steps(self):
+        # best_move agrees with the sorted list of moves after each step
+        for i in xrange(4):
+            move = self.table.best_move()
+            valid = [m for m in self.table.moves()
+                     if not (m[1] and self.table._creates_cycle(m[1], m[2]))]
+            assert move == valid[0]
+
+            delta,add,remove = move
+            self.ne.apply_move(add, remove)
+            self.table.update(add, remove)
+            assert (self.table.edges == 
+                    self.ne.network.edges.adjacency_matrix).all()
+
+def test_gelman_rubin():
+    from pebl.util import gelman_rubin
+    assert gelman_rubin([[1,2,3,4], [1,2,3,4]]) < 1.0
+    assert gelman_rubin([[1,2,1,2], [10,11,10,11]]) > 5.0
+    assert gelman_rubin([[1,1,1], [1,1,1]]) == 1.0
+    assert gelman_rubin([[1,1,1], [2,2,2]]) == float('inf')
+
 class TestMissingDataNetworkEvaluator:
     neteval_type = evaluator.MissingDataNetworkEvaluator
 
@@ -226,9 +435,301 @@ class TestMissingDataNetworkEvaluator:
 
         assert score1 == score2, "Altering and unaltering data leaves score unchanged."
 
+    def test_sweep(self):
+        # the sweep only rescores markov blankets but must leave the
+        # samplescores and the data consistent
+        ne = self.neteval1
+        ne.score_network()
+        ne._init_sampler(None)
+        scores = ne._sweep()
+
+        assert len(scores) == len(ne.missing_indices)
+        assert allclose(scores[-1], ne._score_network_with_tempdata())
+        parents = ne.network.edges.parents
+        for node in ne.cpds:
+            assert allclose(ne.samplescores[node], 
+                            ne._cpd(node, parents(node)).loglikelihood())
+
+    def test_warm_start(self):
+        # only c (20 values) is missing and its family changes: 
+        # max_iterations=400, burnin=200, reburnin=40
+        ne = self.neteval_type(self.data, self.net, max_iterations="n**2")
+        ne.score_network()
+        assert len(ne.chosenscores) == 400
+        
+        values = ne._missingvals()
+        starts = []
+        init_sampler = ne._init_sampler
+        ne._init_sampler = lambda state: starts.append(state) or init_sampler(state)
+        
+        ne.alter_network(add=[(0,3)])
+        assert starts[0].assignedvals == values
+        assert len(ne.chosenscores) == 400 - 200 + 40
+
+        ne = self.neteval_type(self.data, self.net, max_iterations="n**2",
+                               start='random')
+        ne.score_network()
+        ne.alter_network(add=[(0,3)])
+        assert len(ne.chosenscores) == 400
+
+    def test_score_move(self):
+        self.neteval1.score_network()
+        edges = list(self.neteval1.network.edges)
+        self.neteval1.score_move(add=[(0,1)])
+        assert list(self.neteval1.network.edges) == edges
+
+    def test_observed_families_cached(self):
+        # families without missing values don't need sampling
+        ne = self.neteval1
+        score1 = ne.score_network()
+        ne._score_missing_families = lambda: 1/0
+        score2 = ne.alter_network(add=[(0,1)])
+        
+        assert ne.missingfamilies == {2: (0,1), 3: (2,), 4: (2,)}
+        assert allclose(score2 - score1, 
+                        ne._localscore(1, [0]) - ne._localscore(1, []))
+        assert allclose(ne.restore_network(), score1)
+
+    def test_missing_families_sampled(self):
+        ne = self.neteval1
+        ne.score_network()
+        calls = []
+        sample = ne._score_missing_families
+        ne._score_missing_families = lambda: calls.append(1) or sample()
+        
+        ne.alter_network(remove=[(2,3)])
+        assert len(calls) == 1
+        assert ne.missingfamilies == {2: (0,1), 4: (2,)}
+
+        ne.restore_network()
+        assert ne.missingfamilies == {2: (0,1), 3: (2,), 4: (2,)}
+        assert len(calls) == 1
+
+    def test_chains(self):
+        for execution in ('serial', 'parallel'):
+            ne = self.neteval_type(self.data, self.net, max_iterations="n**3", 
+                                   chains=3, rhat=1.5, burnin=1, 
+                                   chain_execution=execution)
+            score = ne.score_network()
+            num_missing = len(ne.missing_indices)
+
+            assert score > float('-inf')
+            assert len(ne.gibbs_state.assignedvals) == num_missing
+            assert len(ne.chosenscores) % 3 == 0
+            assert len(ne.chosenscores) < 3 * num_missing**3
+
+    def test_chains_no_iterations(self):
+        # like a single chain, each chain runs at least one sweep
+        ne = self.neteval_type(self.data, self.net, max_iterations="0", 
+                               chains=2, chain_execution='serial')
+        assert ne.score_network() > float('-inf')
+        assert len(ne.chosenscores) == 2 * len(ne.missing_indices)
+
+    def test_chains_resume(self):
+        ne = self.neteval_type(self.data, self.net, max_iterations="n", chains=2)
+        ne.score_network()
+        numscores = ne.gibbs_state.numscores
+        ne.score_network(gibbs_state=ne.gibbs_state)
+        assert ne.gibbs_state.numscores == numscores + len(ne.chosenscores)
+
 class TestMissingDataMaximumEntropyNetworkEvaluator(TestMissingDataNetworkEvaluator):
     neteval_type = evaluator.MissingDataMaximumEntropyNetworkEvaluator
 
+    def test_swaps_keep_distribution(self):
+        # swaps don't change the number of samples with each value 
+        ne = self.neteval1
+        ne.score_network()
+        ne._init_sampler(None)
+        counts = bincount(ne.data.observations[:,2], minlength=3)
+        assert counts.max() - counts.min() <= 1
+
+        for i in xrange(5):
+            ne._sweep()
+        assert (bincount(ne.data.observations[:,2], minlength=3) == counts).all()
+
+class TestMissingDataExactNetworkEvaluator:
+    def setUp(self):
+        self.data = data.fromfile(testfile('testdata11.txt'))
+        self.net = network.Network(self.data.variables, "0,1;2,1;1,3")
+        self.neteval = evaluator.MissingDataExactNetworkEvaluator(self.data, self.net)
+
+    def test_gray_code_enumeration(self):
+        # compare with scoring every completion from scratch
+        from pebl.util import cartesian_product, logsum
+        ne = self.neteval
+        score = ne.score_network()
+
+        missing = ne.missing_indices
+        possiblevals = [range(self.data.variables[col].arity) for row,col in missing]
+        ne._init_state()
+        scores = []
+        for assignedvals in cartesian_product(possiblevals):
+            for (row,col),val in zip(missing, assignedvals):
+                ne._alter_data(row, col, val)
+            scores.append(ne._score_network_with_tempdata())
+
+        assert allclose(score, logsum(scores) - log(len(scores)))
+
+    def test_processes(self):
+        score = self.neteval.score_network()
+        for processes in (2, 3):
+            ne = evaluator.MissingDataExactNetworkEvaluator(
+                self.data, self.net, processes=processes)
+            assert len(ne._shards([2] * len(ne.missing_indices))) >= 4 * processes
+            assert allclose(ne.score_network(), score)
+
+    def test_gray_code_product(self):
+        from pebl.util import gray_code_product
+        digits = [0,0,0]
+        seen = set([tuple(digits)])
+        for i,val in gray_code_product([2,3,4]):
+            assert abs(digits[i] - val) == 1
+            digits[i] = val
+            seen.add(tuple(digits))
+        assert len(seen) == 24
+
+class TestMissingDataStructuralEMNetworkEvaluator:
+    def setUp(self):
+        a,b,c,d,e = 0,1,2,3,4
+        
+        self.data = data.fromfile(testfile('testdata9.txt'))
+        self.net = network.fromdata(self.data)
+        self.net.edges.add_many([(a,c), (b,c), (c,d), (c,e)])
+        self.neteval1 = evaluator.MissingDataStructuralEMNetworkEvaluator(
+            self.data, self.net, estep_interval=3)
+
+    def test_completions(self):
+        # every sample has one missing value (c) with 3 possible values
+        ne = self.neteval1
+        assert ne.completed.shape == (60, 5)
+        assert len(ne.blocks) == 20
+        assert allclose(ne.weights.sum(), 20.0)
+        assert allclose(ne._expected_counts(2, [0,1]).sum(), 20.0)
+
+    def test_observed_families_cached(self):
+        ne = self.neteval1
+        score1 = ne.score_network()
+        score2 = ne.alter_network(add=[(0,1)])
+        
+        assert (1,0) in ne.localscore_cache._cache
+        assert allclose(score2 - score1,
+                        ne.localscore_cache(1, [0]) - ne.localscore_cache(1, []))
+        assert allclose(ne.restore_network(), score1)
+
+    def test_score_move(self):
+        ne = self.neteval1
+        score1 = ne.score_network()
+        delta = ne.score_move(remove=[(2,3)])
+        assert allclose(ne.alter_network(remove=[(2,3)]), score1 + delta)
+
+    def test_expectation_step(self):
+        # the E-step leaves the current score unchanged
+        ne = self.neteval1
+        ne.score_network()
+        score1 = ne.alter_network(add=[(0,1)])
+        assert allclose(ne.expectation_step(), score1)
+        assert allclose(ne.score_network(), score1)
+
+        # changes made before the E-step can't be undone
+        assert allclose(ne.restore_network(), score1)
+        assert (0,1) in ne.network.edges
+
+    def test_estep_interval(self):
+        ne = self.neteval1
+        ne.score_network()
+        calls = []
+        estep = ne.expectation_step
+        ne.expectation_step = lambda: calls.append(1) or estep()
+
+        for edge in [(0,1), (0,3), (1,3)]:
+            ne.alter_network(add=[edge])
+        ne.restore_network()
+        ne.alter_network(add=[(1,4)])
+        assert len(calls) == 0
+        ne.alter_network(add=[(0,4)])
+        assert len(calls) == 1
+
+    def test_sem_scoring(self):
+        # after a few E-steps, the network with the hidden node scores better
+        # than the one without it, when both are scored with the same
+        # expected counts. The initial weights of the completions are random,
+        # so this is checked over several random restarts.
+        a,b,c,d,e = 0,1,2,3,4
+        wins = 0
+        for restart in xrange(5):
+            ne = evaluator.MissingDataStructuralEMNetworkEvaluator(
+                self.data, self.net.copy(), estep_interval=3)
+            ne.score_network()
+            for i in xrange(10):
+                ne.expectation_step()
+
+            score1 = ne.score_network()
+            score2 = ne.alter_network(add=[(a,d), (a,e), (b,d), (b,e)],
+                                      remove=[(a,c), (b,c), (c,d), (c,e)])
+            wins += score1 > score2
+        assert wins >= 3
+
+    def test_score_networks(self):
+        # scores include the offset kept across E-steps
+        ne = self.neteval1
+        ne.score_network()
+        ne.expectation_step()
+        assert ne.score_offset != 0.0
+
+        net = ne.network.copy()
+        net.edges.add((0,1))
+        for processes in (1, 2):
+            scores = ne.score_networks([ne.network, net], processes=processes)
+            assert allclose(scores[0], ne.score_network())
+            assert allclose(scores[1], ne.alter_network(add=[(0,1)]))
+            ne.restore_network()
+
+    def test_append_data(self):
+        ne = self.neteval1
+        score = ne.score_network()
+        try:
+            ne.append_data(self.data.observations[:5])
+        except Exception:
+            assert True
+        else:
+            assert False
+        assert ne.data.samples.size == 20 and ne.completed.shape == (60, 5)
+        assert ne.score_network() == score
+
+    def test_add_variables(self):
+        ne = self.neteval1
+        ne.score_network()
+        try:
+            ne.add_variables(self.data.observations[:,:1])
+        except Exception:
+            assert True
+        else:
+            assert False
+        assert ne.data.variables.size == 5 and len(ne.arities) == 5
+        assert len(ne.network.nodes) == 5
+
+    def test_pickle(self):
+        import cPickle
+        ne = self.neteval1
+        score = ne.score_network()
+        ne2 = cPickle.loads(cPickle.dumps(ne, 2))
+        assert allclose(ne2.score_network(), score)
+        assert allclose(ne2.alter_network(add=[(0,1)]),
+                        ne.alter_network(add=[(0,1)]))
+
+        # timed evaluators are rebuilt with their timers
+        ne.instrument()
+        ne3 = cPickle.loads(cPickle.dumps(ne, 2))
+        assert allclose(ne3.alter_network(remove=[(2,3)]),
+                        ne.alter_network(remove=[(2,3)]))
+        assert ne3.stats.calls['cache'] > 0
+
+    def test_fromconfig(self):
+        config.set('evaluator.missingdata_evaluator', 'sem')
+        ne = evaluator.fromconfig(self.data, self.net)
+        assert isinstance(ne, evaluator.MissingDataStructuralEMNetworkEvaluator)
+        config.set('evaluator.missingdata_evaluator', 'gibbs')
+
 """
 
 Test out the smart network evaluator
@@ -282,6 +783,400 @@ Test the exact enumerating missing data evaluator
 
 """
 
+class TestInstrumentation:
+    def setUp(self):
+        self.data = data.fromfile(testfile('testdata10.txt'))
+        self.neteval = evaluator.SmartNetworkEvaluator(
+            self.data, network.fromdata(self.data))
+        self.stats = self.neteval.instrument()
+
+    def test_phases(self):
+        ne = self.neteval
+        ne.score_network()
+        ne.alter_network(add=[(0,1), (1,2)])
+        ne.restore_network()
+
+        for phase in evaluator.EvaluatorStats.phases:
+            assert self.stats.calls[phase] > 0, phase
+        assert self.stats.calls['cpt'] == ne.localscore_cache.misses
+        assert ne.stats is self.stats
+
+    def test_scores_unchanged(self):
+        ne2 = evaluator.SmartNetworkEvaluator(self.data, network.fromdata(self.data))
+        for ne in (self.neteval, ne2):
+            ne.score_network()
+            ne.alter_network(add=[(0,1), (1,2)])
+        assert self.neteval.score == ne2.score
+
+    def test_pickle(self):
+        import cPickle
+        ne = self.neteval
+        ne.score_network()
+        ne2 = cPickle.loads(cPickle.dumps(ne))
+        assert ne2.stats.calls == ne.stats.calls
+        
+        ne2.alter_network(add=[(0,1)])
+        assert ne2.stats.calls['backup'] == ne.stats.calls['backup'] + 1
+
+    def test_fromconfig(self):
+        config.set('evaluator.instrument', 1)
+        try:
+            ne = evaluator.fromconfig(self.data)
+        finally:
+            config.set('evaluator.instrument', 0)
+        assert ne.stats is not None
+
+    def test_report(self):
+        self.neteval.score_network()
+        stats = evaluator.EvaluatorStats().merge(self.stats).merge(self.stats)
+        assert stats.calls['cache'] == 2 * self.stats.calls['cache']
+        assert len(stats.report().splitlines()) == len(stats.phases) + 1
+
+class TestRacing:
+    def setUp(self):
+        self.data = data.fromfile(testfile('greedytest1-200.txt'))
+        self.neteval = evaluator.SmartNetworkEvaluator(
+            self.data, network.fromdata(self.data))
+        self.neteval.racing_subsample = 20
+        self.score = self.neteval.score_network()
+
+    def test_bad_move(self):
+        # adding 0->3 lowers the score by ~4.6
+        ne = self.neteval
+        assert ne.race_move(add=[(0,3)], minscore=self.score + 50) == False
+        assert ne.race_move(add=[(0,3)], minscore=self.score - 50) == True
+        assert ne.score == self.score
+
+    def test_good_move(self):
+        # adding 3->4 raises the score by ~93
+        assert self.neteval.race_move(add=[(3,4)], minscore=self.score)
+
+    def test_disabled(self):
+        self.neteval.racing_subsample = 0
+        assert self.neteval.race_move(add=[(0,3)], minscore=self.score + 50)
+
+    def test_prior(self):
+        ne = evaluator.SmartNetworkEvaluator(
+            self.data, network.fromdata(self.data),
+            prior.Prior(self.data.variables.size, prohibited_edges=[(0,3)]))
+        ne.racing_subsample = 20
+        ne.score_network()
+        assert ne.race_move(add=[(0,3)], minscore=self.score - 50) == False
+        assert ne.race_move(add=[(0,3)])
+
+    def test_good_removal(self):
+        # with independent variables, removing either parent of 1 raises the
+        # score by ~200 even though the smaller family fits the subsample
+        # worse than the larger one.
+        from numpy.random import RandomState
+        variables = array([data.DiscreteVariable(str(i), 4) for i in xrange(6)])
+        observations = RandomState(3).randint(0, 4, (20000, 6))
+        data_ = data.Dataset(observations, variables=variables)
+        ne = evaluator.SmartNetworkEvaluator(
+            data_, network.Network(variables, "0,1;2,1;3,1"))
+        ne.racing_subsample = 500
+        score = ne.score_network()
+        for edge in [(0,1), (2,1)]:
+            for i in xrange(5):
+                ne._racing_rows = None
+                assert ne.race_move(remove=[edge], minscore=score)
+        assert not ne.race_move(add=[(4,1)], minscore=score)
+
+class TestAppendData:
+    def setUp(self):
+        self.data = data.fromfile(testfile('greedytest1-200.txt'))
+        self.newrows = self.data.observations[150:]
+        self.data = self.data.subset(samples=range(150))
+        self.net = network.Network(self.data.variables, "0,2;1,3;3,4")
+
+    def _check(self, keep_cpds):
+        config.set('localscore_cache.keep_cpds', keep_cpds)
+        try:
+            ne = evaluator.SmartNetworkEvaluator(self.data, self.net.copy())
+        finally:
+            config.set('localscore_cache.keep_cpds', 0)
+        ne.score_network()
+        ne.alter_network(add=[(2,4)])
+        misses = ne.localscore_cache.misses
+
+        score = ne.append_data(self.newrows)
+        assert self.data.samples.size == 200
+        assert ne.restore_network() == score
+        assert (2,4) in ne.network.edges
+
+        full = data.fromfile(testfile('greedytest1-200.txt'))
+        ne2 = evaluator.SmartNetworkEvaluator(full, self.net.copy())
+        ne2.alter_network(add=[(2,4)])
+        assert allclose(score, ne2.score)
+        assert allclose(ne.score_network(self.net.copy()), ne2.score_network(self.net.copy()))
+        return ne.localscore_cache.misses - misses
+
+    def test_keep_cpds(self):
+        # all localscores were updated with the new samples
+        assert self._check(1) == 0
+
+    def test_discard(self):
+        assert self._check(0) == 6
+
+    def test_missing(self):
+        ne = evaluator.MissingDataNetworkEvaluator(
+            data.fromfile(testfile('testdata9.txt')), self.net.copy())
+        try:
+            ne.append_data(self.newrows)
+        except Exception:
+            assert True
+        else:
+            assert False
+
+class TestSlidingWindowNetworkEvaluator:
+    def setUp(self):
+        self.full = data.fromfile(testfile('greedytest1-200.txt'))
+        self.net = network.Network(self.full.variables, "0,2;1,3;3,4")
+        self.neteval = evaluator.SlidingWindowNetworkEvaluator(
+            self.full.subset(samples=range(100)), self.net.copy(), size=80)
+        self.neteval.score_network()
+
+    def _expected(self, start, stop, net=None):
+        ne = evaluator.SmartNetworkEvaluator(
+            self.full.subset(samples=range(start, stop)), 
+            (net or self.net).copy())
+        return ne.score_network()
+
+    def test_window(self):
+        ne = self.neteval
+        assert ne.data.samples.size == 80
+        assert allclose(ne.score, self._expected(20, 100))
+
+        misses = ne.localscore_cache.misses
+        for start in (100, 130, 160):
+            score = ne.append_data(self.full.observations[start:start+30])
+            assert allclose(score, self._expected(start-50, start+30))
+        assert ne.data.samples.size == 80
+        assert ne.localscore_cache.misses == misses
+
+    def test_ring_buffer(self):
+        # the window's arrays are overwritten in place, wrapping around
+        ne = self.neteval
+        observations = ne.data.observations
+        for start,stop in ((100, 150), (150, 190), (190, 200)):
+            score = ne.append_data(self.full.observations[start:stop])
+            assert allclose(score, self._expected(stop-80, stop))
+        assert ne.data.observations is observations
+
+        # only the last window.size samples of a large batch are kept
+        score = ne.append_data(self.full.observations[:100])
+        assert allclose(score, self._expected(20, 100))
+
+    def test_fill_window(self):
+        ne = evaluator.SlidingWindowNetworkEvaluator(
+            self.full.subset(samples=range(50)), self.net.copy(), size=80)
+        assert allclose(ne.append_data(self.full.observations[50:70]),
+                        self._expected(0, 70))
+        assert allclose(ne.append_data(self.full.observations[70:100]),
+                        self._expected(20, 100))
+        assert ne.data.samples.size == 80
+
+    def test_new_family(self):
+        ne = self.neteval
+        ne.append_data(self.full.observations[100:110])
+        score = ne.alter_network(add=[(2,4)])
+        assert allclose(score, self._expected(30, 110, ne.network))
+        ne.append_data(self.full.observations[110:120])
+        assert allclose(ne.score, self._expected(40, 120, ne.network))
+        assert allclose(ne.score_network(self.net.copy()), 
+                        self._expected(40, 120))
+
+    def test_initial_data_unchanged(self):
+        initial = self.full.subset(samples=range(50))
+        ne = evaluator.SlidingWindowNetworkEvaluator(initial, self.net.copy())
+        ne.append_data(self.full.observations[50:60])
+        assert ne.size == 50 and initial.samples.size == 50
+        assert allclose(ne.score, self._expected(10, 60))
+
+class TestPooledNetworkEvaluator:
+    def setUp(self):
+        self.full = data.fromfile(testfile('greedytest1-200.txt'))
+        self.datasets = [self.full.subset(samples=range(i, i+50)) 
+                         for i in (0, 50, 100)]
+        self.net = network.Network(self.full.variables, "0,2;1,3;3,4")
+
+    def _smartscore(self, data_, edges=[]):
+        ne = evaluator.SmartNetworkEvaluator(data_, self.net.copy())
+        ne.score_network()
+        return ne.alter_network(add=edges)
+
+    def test_joint(self):
+        ne = evaluator.PooledNetworkEvaluator(self.datasets, self.net.copy())
+        full = self.full.subset(samples=range(150))
+        assert allclose(ne.score_network(), self._smartscore(full))
+        assert allclose(ne.alter_network(add=[(2,4)]),
+                        self._smartscore(full, [(2,4)]))
+
+    def test_separate(self):
+        ne = evaluator.PooledNetworkEvaluator(self.datasets, self.net.copy(),
+                                              mode='separate')
+        assert allclose(ne.alter_network(add=[(2,4)]),
+                        sum(self._smartscore(d, [(2,4)]) for d in self.datasets))
+
+    def test_append_data(self):
+        ne = evaluator.PooledNetworkEvaluator(self.datasets, self.net.copy())
+        ne.score_network()
+        ne.alter_network(add=[(2,4)])
+        score = ne.append_data(self.full.observations[150:], index=1)
+        assert allclose(score, self._smartscore(self.full, [(2,4)]))
+
+    def test_replace_dataset(self):
+        ne = evaluator.PooledNetworkEvaluator(self.datasets, self.net.copy())
+        ne.score_network()
+        cpds = dict(ne._datasetcpds[0])
+        score = ne.replace_dataset(2, self.full.subset(samples=range(100, 200)))
+        assert allclose(score, self._smartscore(self.full))
+
+        # the cpds for the other datasets are reused
+        assert all(ne._datasetcpds[0][k] is c for k,c in cpds.iteritems())
+
+    def test_arities(self):
+        datasets = [d.subset() for d in self.datasets]
+        datasets[2].variables = array([copy.copy(v) for v in datasets[2].variables])
+        datasets[2].variables[3].arity += 1
+        try:
+            evaluator.PooledNetworkEvaluator(datasets, self.net.copy())
+        except Exception, e:
+            assert "dataset 2" in str(e)
+        else:
+            assert False
+
+    def test_missing(self):
+        datasets = [d.subset() for d in self.datasets]
+        datasets[1].missing[3,2] = True
+        try:
+            evaluator.PooledNetworkEvaluator(datasets, self.net.copy())
+        except Exception, e:
+            assert "Dataset 1" in str(e)
+        else:
+            assert False
+
+        ne = evaluator.PooledNetworkEvaluator(self.datasets, self.net.copy())
+        score = ne.score_network()
+        for change in (lambda: ne.replace_dataset(2, datasets[1]),
+                       lambda: ne.append_data(self.full.observations[150:], 
+                                              missing=datasets[1].missing,
+                                              index=2)):
+            try:
+                change()
+            except Exception:
+                assert True
+            else:
+                assert False
+        assert ne.datasets[2].samples.size == 50 and ne.score == score
+
+    def test_bounded_cpds(self):
+        config.set('localscore_cache.maxsize', 3)
+        try:
+            ne = evaluator.PooledNetworkEvaluator(self.datasets, self.net.copy())
+        finally:
+            config.set('localscore_cache.maxsize', -1)
+        ne.score_network()
+        ne.alter_network(add=[(2,4)])
+        assert all(len(cpds) == 3 for cpds in ne._datasetcpds)
+
+    def test_instrument(self):
+        ne = evaluator.PooledNetworkEvaluator(self.datasets, self.net.copy())
+        stats = ne.instrument()
+        full = self.full.subset(samples=range(150))
+        assert allclose(ne.score_network(), self._smartscore(full))
+        assert stats.calls['cpt'] == 3 * ne.localscore_cache.misses
+
+class TestAddVariables:
+    def setUp(self):
+        self.full = data.fromfile(testfile('greedytest1-200.txt'))
+        self.data = self.full.subset(range(3))
+        self.neteval = evaluator.SmartNetworkEvaluator(
+            self.data, network.Network(self.data.variables, "0,2;1,2"))
+        self.neteval.score_network()
+
+    def test_add_variables(self):
+        ne = self.neteval
+        misses = ne.localscore_cache.misses
+        score = ne.add_variables(self.full.observations[:,3:],
+                                 variables=self.full.variables[3:])
+        
+        # only the new nodes were scored
+        assert ne.localscore_cache.misses == misses + 2
+        assert ne.restore_network() == score
+
+        full = evaluator.SmartNetworkEvaluator(
+            self.full, network.Network(self.full.variables, "0,2;1,2"))
+        assert allclose(score, full.score_network())
+        assert allclose(ne.alter_network(add=[(3,4), (4,2)]), 
+                        full.alter_network(add=[(3,4), (4,2)]))
+
+    def test_prior(self):
+        ne = evaluator.SmartNetworkEvaluator(
+            self.data, network.Network(self.data.variables, "0,2;1,2"),
+            prior.Prior(3, prohibited_edges=[(0,1)]))
+        try:
+            ne.add_variables(self.full.observations[:,3:])
+        except Exception:
+            assert True
+        else:
+            assert False
+
+        score = ne.add_variables(self.full.observations[:,3:], 
+                                 prior_=prior.Prior(5, prohibited_edges=[(3,4)]))
+        assert ne.alter_network(add=[(3,4)]) == prior.NEGINF
+
+class TestScoreNetworks:
+    def setUp(self):
+        self.data = data.fromfile(testfile('greedytest1-200.txt'))
+        self.neteval = evaluator.SmartNetworkEvaluator(
+            self.data, network.fromdata(self.data))
+        netstrings = ["0,1;1,2", "0,1;1,2;3,4", "1,2;3,4", "", "3,4;0,1"]
+        self.networks = [network.Network(self.data.variables, s) 
+                         for s in netstrings]
+
+    def _expected(self):
+        ne = evaluator.SmartNetworkEvaluator(
+            self.data, network.fromdata(self.data))
+        return [ne.score_network(net.copy()) for net in self.networks]
+
+    def test_score_networks(self):
+        ne = self.neteval
+        score = ne.score_network()
+        assert allclose(ne.score_networks(self.networks), self._expected())
+        
+        # each distinct family was scored once
+        assert ne.localscore_cache.misses == 8
+        assert ne.score == score and not list(ne.network.edges)
+
+    def test_processes(self):
+        ne = self.neteval
+        assert allclose(ne.score_networks(self.networks, processes=3), 
+                        self._expected())
+        assert allclose(ne.score_networks(self.networks, processes=3), 
+                        self._expected())
+
+        # the families scored in the other processes were cached
+        assert ne.localscore_cache.misses == 0
+        assert len(ne.localscore_cache._cache) == 8
+
+    def test_cyclic(self):
+        net = network.Network(self.data.variables, "0,1;1,0")
+        try:
+            self.neteval.score_networks(self.networks + [net])
+        except evaluator.CyclicNetworkError:
+            assert True
+        else:
+            assert False
+
+    def test_missing(self):
+        data9 = data.fromfile(testfile('testdata9.txt'))
+        ne = evaluator.MissingDataNetworkEvaluator(data9, 
+                                                   network.fromdata(data9))
+        nets = [network.Network(data9.variables, s) for s in ("0,1", "2,3")]
+        scores = ne.score_networks(nets)
+        assert len(scores) == 2 and scores[1] == ne.score
+
 class TestLocalscoreCache:
     def setUp(self):
         self.data = data.fromfile(testfile('testdata10.txt'))
@@ -303,3 +1198,12 @@ class TestLocalscoreCache:
 
         assert len(c._cache) <= 3
 
+    def test_update_lru(self):
+        c = evaluator.LocalscoreCache(self.evaluator, 3)
+        for node in xrange(4):
+            c(node, [])
+        newdata = self.data.append(self.data.observations[:2])
+        c.update(newdata)
+        assert not c._cache and not c._refcount and not c._queue
+        c(0, [])
+        assert len(c._cache) == 1
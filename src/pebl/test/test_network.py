@@ -134,6 +134,14 @@ class TestNetwork:
     def test_as_string(self):
         assert self.net.as_string() == self.expected_string, "Create string representation."
 
+    def test_add_nodes(self):
+        self.net.add_nodes([data.DiscreteVariable(i,3) for i in (6,7)])
+        assert len(self.net.nodes) == 8 and self.net.nodeids == range(8)
+        assert self.net.as_string() == self.expected_string
+        self.net.edges.add((7,0))
+        assert self.net.edges.parents(0) == [7]
+        assert self.net.is_acyclic()
+
     def test_layout(self):
         self.net.layout()
         assert hasattr(self.net, 'node_positions'), "Has node_positions"
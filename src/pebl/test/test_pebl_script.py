@@ -4,7 +4,7 @@ import tempfile
 import os.path
 import shutil
 
-from pebl import pebl_script
+from pebl import pebl_script, config, result
 from pebl.test import testfile
 
 class TestHtmlReport:
@@ -34,3 +34,38 @@ class TestHtmlReport:
 
 
         
+
+class TestStats:
+    def setup(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.resultfile = os.path.join(self.tempdir, 'result.pebl')
+
+        stats_config = textwrap.dedent("""
+        [data]
+        filename = %s
+
+        [evaluator]
+        instrument = 1
+
+        [greedy]
+        max_iterations = 100
+
+        [result]
+        format = pickle
+        filename = %s
+        """ % (testfile("testdata12.txt"), self.resultfile))
+        
+        configfile = os.path.join(self.tempdir, "config.txt")
+        with file(configfile, 'w') as f:
+            f.write(stats_config)
+
+    def teardown(self):
+        config.set('evaluator.instrument', 0)
+        config.set('result.filename', 'result.pebl')
+        shutil.rmtree(self.tempdir)
+
+    def test_stats(self):
+        pebl_script.run(os.path.join(self.tempdir, 'config.txt'))
+        stats = result.fromfile(self.resultfile).evaluator_stats
+        assert stats.calls['cache'] > 0
+        pebl_script.stats(self.resultfile)
@@ -1,5 +1,6 @@
 import numpy as N
-from pebl import data, network, prior
+from pebl import data, network, prior, config
+from pebl.test import testfile
 
 
 def test_null_prior():
@@ -70,6 +71,67 @@ class TestHardPriors:
         self.net.edges.add((3,2))     
         assert self.p.loglikelihood(self.net) == 0.0
         
+class TestEdgeConstraints:
+    def setUp(self):
+        self.net = network.Network(
+            [data.DiscreteVariable(i,3) for i in xrange(5)], 
+            "0,1;3,2;2,4;1,4"
+        )
+        self.p = prior.Prior(
+            len(self.net.nodes), 
+            prohibited_edges=[(3,4)], 
+            edge_constraints=[lambda src,dest: dest != 0],
+            max_indegree=2,
+            max_outdegree=2
+        )
+ 
+    def test_allows(self):
+        assert self.p.allows(0,2)
+        assert not self.p.allows(2,0)
+        assert not self.p.allows(3,4)
+        assert not self.p.allows(1,1)
+
+    def test_allows_move(self):
+        assert self.p.allows_move(self.net, add=[(0,2)])
+        assert not self.p.allows_move(self.net, add=[(1,0)], remove=[(0,1)])
+        assert not self.p.allows_move(self.net, add=[(0,4)])
+        assert self.p.allows_move(self.net, add=[(0,4)], remove=[(1,4)])
+        assert not self.p.allows_move(self.net, add=[(1,2), (1,3)])
+
+    def test_net1(self):
+        assert self.p.loglikelihood(self.net) == 0.0
+
+    def test_net2(self):
+        self.net.edges.add((4,0))
+        assert self.p.loglikelihood(self.net) == float('-inf')
+
+    def test_indegree(self):
+        self.net.edges.add((0,4))
+        assert self.p.loglikelihood(self.net) == float('-inf')
+
+    def test_outdegree(self):
+        self.net.edges.add((1,2))
+        self.net.edges.add((1,3))
+        assert self.p.loglikelihood(self.net) == float('-inf')
+
+    def test_state(self):
+        state = self.p.state(self.net)
+        assert state.loglikelihood_after(add=[(4,0)]) == float('-inf')
+        assert state.loglikelihood_after(add=[(0,4)]) == float('-inf')
+        assert state.loglikelihood_after(add=[(0,4)], remove=[(2,4)]) == 0.0
+
+        self.net.edges.add((0,4))
+        state.update(add=[(0,4)])
+        assert state.loglikelihood() == float('-inf')
+
+        self.net.edges.remove((1,4))
+        state.update(remove=[(1,4)])
+        assert state.loglikelihood() == 0.0
+
+    def test_null_prior(self):
+        assert prior.NullPrior().allows(2,0)
+        assert prior.NullPrior().allows_move(self.net, add=[(0,4)])
+
 class TestSoftPriors:
     def setUp(self):
         self.net = network.Network(
@@ -115,3 +177,170 @@ class TestCombinedPriors:
         self.net.edges.remove((1,2))
         assert self.p.loglikelihood(self.net) == float('-inf')
 
+
+class TestPriorState:
+    def setUp(self):
+        self.net = network.Network(
+            [data.DiscreteVariable(i,3) for i in xrange(5)], 
+            "0,1;1,3;1,2"
+        )
+        energymat = N.array([[ 0.5,  0. ,  0.5,  0.5,  0.5],
+                             [ 0.5,  0.5,  0.5,  0.5,  0. ],
+                             [ 0.5,  0.5,  0.5,  0.5,  0.5],
+                             [ 0.5,  0.5,  0.5,  0.5,  5. ],
+                             [ 0.5,  0.5,  0.5,  0.5,  0.5]])
+        self.p = prior.Prior(len(self.net.nodes), energymat, 
+                             required_edges=[(1,2)], prohibited_edges=[(2,0)])
+        self.state = self.p.state(self.net)
+
+    def test_initial(self):
+        assert self.state.loglikelihood() == self.p.loglikelihood(self.net)
+
+    def test_loglikelihood_after(self):
+        assert self.state.loglikelihood_after(add=[(3,4)]) == -6.0
+        assert self.state.loglikelihood_after(remove=[(1,2)]) == float('-inf')
+        assert self.state.loglikelihood_after(add=[(2,0)]) == float('-inf')
+        assert self.state.loglikelihood() == -1.0
+
+    def test_update(self):
+        self.net.edges.add((3,4))
+        self.net.edges.remove((1,3))
+        self.state.update(add=[(3,4)], remove=[(1,3)])
+        assert self.state.loglikelihood() == self.p.loglikelihood(self.net)
+
+    def test_violations(self):
+        self.net.edges.remove((1,2))
+        self.state.update(remove=[(1,2)])
+        assert self.state.loglikelihood() == float('-inf')
+
+        self.net.edges.add((1,2))
+        self.state.update(add=[(1,2)])
+        assert self.state.loglikelihood() == -1.0
+
+    def test_constraints(self):
+        self.p.constraints = [lambda am: not am[0,4]]
+        assert self.state.loglikelihood_after(add=[(0,4)]) == float('-inf')
+        assert self.state.loglikelihood_after(add=[(0,3)]) == -1.5
+
+def test_null_prior_state():
+    net = network.Network(
+        [data.DiscreteVariable(i,3) for i in xrange(5)], 
+        "0,1;3,2;2,4;1,4"
+    )
+    state = prior.NullPrior().state(net)
+    assert state.loglikelihood() == 0.0
+    assert state.loglikelihood_after(add=[(0,2)]) == 0.0
+
+class TestSparsePrior:
+    def setUp(self):
+        self.net = network.Network(
+            [data.DiscreteVariable(i,3) for i in xrange(5)], 
+            "0,1;1,3;1,2"
+        )
+        energymat = N.ones((5,5)) * .5
+        energymat[0,1] = 0.0
+        energymat[1,4] = 0.0
+        energymat[3,4] = 5.0
+        self.dense = prior.Prior(5, energymat, required_edges=[(1,2)], 
+                                 prohibited_edges=[(2,0)])
+        self.sparse = prior.SparsePrior(5, {(0,1): 0.0, (1,4): 0.0, (3,4): 5.0},
+                                        required_edges=[(1,2)], 
+                                        prohibited_edges=[(2,0)])
+
+    def test_loglikelihood(self):
+        assert self.sparse.loglikelihood(self.net) == \
+               self.dense.loglikelihood(self.net) == -1.0
+
+    def test_loglikelihood_after(self):
+        for add,remove in [([(3,4)], []), ([], [(1,2)]), ([(2,0)], []),
+                           ([(1,4)], [(1,3)])]:
+            assert self.sparse.loglikelihood_after(self.net, add, remove) == \
+                   self.dense.loglikelihood_after(self.net, add, remove)
+
+    def test_edges(self):
+        for src in xrange(5):
+            for dest in xrange(5):
+                assert self.sparse.allows(src, dest) == \
+                       self.dense.allows(src, dest)
+                assert self.sparse.edge_loglikelihood(src, dest) == \
+                       self.dense.edge_loglikelihood(src, dest)
+
+    def test_required_prohibited(self):
+        assert self.sparse.required_edges == [[1,2]]
+        assert self.sparse.prohibited_edges == [[2,0]]
+
+    def test_uniform(self):
+        assert prior.SparsePrior(5).loglikelihood(self.net) == \
+               prior.UniformPrior(5).loglikelihood(self.net)
+
+class TestPriorFile:
+    def setUp(self):
+        self.data = data.fromfile(testfile('testdata5.txt'))
+        self.net = network.Network(self.data.variables, "0,1;2,3")
+
+    def test_fromfile(self):
+        p = prior.fromfile(testfile('prior1.txt'), self.data, default_energy=1.0)
+        assert p.energies == {(0,1): 0.1, (1,2): 0.9}
+        assert p.required_edges == [[2,3]]
+        assert p.prohibited_edges == [[4,0]]
+        assert N.allclose(p.loglikelihood(self.net), -1.1)
+
+    def test_unknown_variable(self):
+        try:
+            prior.fromstring("v1\tfoo\t0.5", self.data)
+        except prior.ParsingError:
+            pass
+        else:
+            assert False, "ParsingError not raised"
+
+    def test_bad_energy(self):
+        try:
+            prior.fromstring("v1\tv2\tfoo", self.data)
+        except prior.ParsingError:
+            pass
+        else:
+            assert False, "ParsingError not raised"
+
+    def test_fromconfig(self):
+        assert isinstance(prior.fromconfig(self.data), prior.NullPrior)
+
+        config.set('prior.filename', testfile('prior1.txt'))
+        config.set('prior.weight', 2.0)
+        try:
+            p = prior.fromconfig(self.data)
+        finally:
+            config.set('prior.filename', '')
+            config.set('prior.weight', 1.0)
+        
+        assert isinstance(p, prior.SparsePrior)
+        assert p.weight == 2.0
+        assert N.allclose(p.loglikelihood(self.net), -1.2)
+
+class TestOrderingPrior:
+    def setUp(self):
+        self.net = network.Network(
+            [data.DiscreteVariable(i,3) for i in xrange(5)], 
+            "0,2;1,2;2,4"
+        )
+        self.p = prior.OrderingPrior([0, 0, 1, 1, 2])
+        self.p2 = prior.OrderingPrior([0, 0, 1, 1, 2], strict=False)
+
+    def test_allows(self):
+        assert self.p.allows(0,2)
+        assert self.p.allows(0,4)
+        assert not self.p.allows(2,0)
+        assert not self.p.allows(2,3)
+        assert self.p2.allows(2,3)
+        assert not self.p2.allows(2,2)
+
+    def test_precedes(self):
+        assert self.p.precedes(0,2)
+        assert not self.p.precedes(2,3)
+        assert not self.p2.precedes(2,3)
+        assert not prior.Prior(5).precedes(0,2)
+
+    def test_loglikelihood(self):
+        assert self.p.loglikelihood(self.net) == -1.5
+        self.net.edges.add((3,2))
+        assert self.p.loglikelihood(self.net) == float('-inf')
+        assert self.p2.loglikelihood(self.net) == -2.0
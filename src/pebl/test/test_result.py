@@ -6,7 +6,7 @@ import os.path
 from numpy import allclose
 
 from pebl import result
-from pebl import data, network
+from pebl import data, network, evaluator
 from pebl.learner import greedy
 from pebl.test import testfile
 
@@ -95,6 +95,18 @@ class TestMergingResults(object):
         mr = result.merge([self.result1, self.result2])
         assert [n.score for n in mr.networks] == [-13, -12, -11, -10.5, -8.5, -6, -5.5]
 
+    def test_merged_evaluator_stats(self):
+        assert self.result1.evaluator_stats is None
+
+        stats = evaluator.EvaluatorStats()
+        stats.calls['cache'] = 3
+        self.result1.stop_run(stats)
+        self.result2.stop_run(stats)
+
+        mr = result.merge(self.result1, self.result2)
+        assert mr.evaluator_stats.calls['cache'] == 6
+        assert stats.calls['cache'] == 3
+
 
 class TestPosterior(TestMergingResults):
     def setUp(self):
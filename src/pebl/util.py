@@ -97,6 +97,33 @@ def logsum(lst):
     return reduce(logadd, lst) + maxval
 
 
+def gelman_rubin(chains):
+    """Returns the Gelman-Rubin convergence statistic (R-hat) for MCMC chains.
+
+    chains is a list of sequences of samples, one per chain, that all have the
+    same length (at least 2). Values close to 1.0 indicate that the chains
+    have converged. If there is no variation within the chains, returns 1.0 if
+    all chains are identical and infinity otherwise.
+
+    For more information, consult:
+
+        1. A. Gelman and D. Rubin. Inference from iterative simulation using
+           multiple sequences. Statistical Science, 7(4):457-472, 1992.
+
+    """
+
+    chains = N.asarray(chains, dtype=float)
+    numsamples = chains.shape[1]
+
+    within = chains.var(axis=1, ddof=1).mean()
+    between = numsamples * chains.mean(axis=1).var(ddof=1)
+    if within == 0:
+        return 1.0 if between == 0 else N.inf
+
+    variance = (numsamples - 1.0)/numsamples * within + between/numsamples
+    return math.sqrt(variance/within)
+
+
 ## from webpy (webpy.org)
 def autoassign(self, locals):
     """
@@ -158,6 +185,34 @@ def cartesian_product(list_of_lists):
                 yield (val,) + val2
 
 
+def gray_code_product(radices):
+    """Enumerate all n-tuples of digits in mixed-radix (reflected) Gray code order.
+
+    Digit i ranges over range(radices[i]). The enumeration starts at the
+    all-zero tuple and only one digit changes between consecutive tuples. For
+    each tuple after the first, yields the (position, value) of the digit
+    that changed.
+
+    >>> list(gray_code_product([2,3]))
+    [(0, 1), (1, 1), (0, 0), (1, 2), (0, 1)]
+
+    """
+
+    digits = [0] * len(radices)
+    directions = [1] * len(radices)
+
+    while True:
+        for i,radix in enumerate(radices):
+            value = digits[i] + directions[i]
+            if 0 <= value < radix:
+                digits[i] = value
+                yield (i, value)
+                break
+            directions[i] = -directions[i]
+        else:
+            return
+
+
 def probwheel(items, weights):
     """Randomly select an item from a weighted list of items."""
     